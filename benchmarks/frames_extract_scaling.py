@@ -0,0 +1,95 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import av
+import cv2
+import numpy as np
+
+from deva_transcript.neural.frames_extract import extract_unique_slides, extract_unique_slides_parallel
+from deva_transcript.neural.media import iter_key_frames, probe_media
+
+
+def make_slide_video(path: pathlib.Path, seconds: int, width: int, height: int, slide_seconds: int, gop: int = 50,
+                     shift_at: float | None = None):
+    """Synthetic deck; from shift_at on the slide is narrower by less than the tracker's 10% area hysteresis"""
+    rate = 25
+    with av.open(str(path), "w") as container:
+        stream = container.add_stream("libx264", rate=rate)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.options = {"g": str(gop), "preset": "ultrafast"}
+        for i in range(seconds * rate):
+            slide = i // (slide_seconds * rate)
+            right = width * 7 // 8
+            if shift_at is not None and i >= shift_at * rate:
+                right -= width // 40
+            img = np.zeros((height, width, 3), np.uint8)
+            cv2.rectangle(img, (width // 8, height // 8), (right, height * 7 // 8), (230, 230, 230), -1)
+            cv2.putText(img, f"Slide {slide % 40}", (width // 4, height // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, height / 200, (0, 0, 0), max(1, height // 100))
+            for packet in stream.encode(av.VideoFrame.from_ndarray(img, format="bgr24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+def slides(result) -> list[tuple[float, str, str]]:
+    # Crops are compared too: a different region can keep names and timecodes but not pixels
+    return [(t, p.name, hashlib.sha256(p.read_bytes()).hexdigest()) for t, _, p in result]
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        temp_dir = pathlib.Path(tmp_dir)
+        video = pathlib.Path(args.video) if args.video else temp_dir / "input.mp4"
+        if not args.video:
+            make_slide_video(video, args.seconds, args.width, args.height, args.slide_seconds, shift_at=args.shift_at)
+        duration = probe_media(video).duration
+
+        output = temp_dir / "sequential"
+        output.mkdir()
+        start = time.perf_counter()
+        reference = slides(extract_unique_slides(iter_key_frames(video), output, duration))
+        sequential = time.perf_counter() - start
+        print(json.dumps({"mode": "sequential", "workers": 1, "seconds": round(sequential, 3),
+                          "slides": len(reference), "video_seconds": duration}))
+
+        workers = 1
+        while workers <= args.max_workers:
+            output = temp_dir / f"parallel_{workers}"
+            output.mkdir()
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                # Warm the pool so process spawn is not billed to the analysis.
+                list(pool.map(int, range(workers)))
+                start = time.perf_counter()
+                result = slides(extract_unique_slides_parallel(
+                    video, output, duration, pool, workers, chunk_seconds=args.chunk_seconds))
+                elapsed = time.perf_counter() - start
+            print(json.dumps({"mode": "parallel", "workers": workers, "seconds": round(elapsed, 3),
+                              "speedup": round(sequential / elapsed, 2), "slides": len(result),
+                              "matches_sequential": result == reference}))
+            workers *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling of slide extraction with process pool size")
+    parser.add_argument("--video", help="Use an existing video instead of a synthetic slide deck")
+    parser.add_argument("--seconds", type=int, default=1800)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--slide-seconds", type=int, default=20)
+    parser.add_argument("--chunk-seconds", type=float, default=300)
+    parser.add_argument("--shift-at", type=float, help="Narrow the slide slightly from this second on")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    run(parser.parse_args())
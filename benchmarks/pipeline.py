@@ -0,0 +1,367 @@
+"""End-to-end task benchmark without RabbitMQ, MinIO, Postgres or an LLM endpoint.
+
+Each scenario runs in its own process so peak RSS is per scenario; every run prints one JSON line.
+
+    python benchmarks/pipeline.py --scenarios transcribe frames_extract summary --audio-seconds 600
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pathlib
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import wave
+from types import SimpleNamespace
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "src"))
+
+import numpy as np
+
+SCENARIOS = ("transcribe", "frames_extract", "summary")
+
+
+def make_speech_like_audio(path: pathlib.Path, seconds: int, rate: int = 16000, seed: int = 0):
+    """Voiced syllables (harmonics of a drifting pitch, ~4 per second) separated by pauses"""
+    rng = np.random.default_rng(seed)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for _ in range(seconds):
+            t = np.arange(rate) / rate
+            pitch = rng.uniform(100, 220) * (1 + 0.05 * np.sin(2 * np.pi * 0.5 * t))
+            phase = 2 * np.pi * np.cumsum(pitch) / rate
+            voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+            syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None)
+            if rng.random() < 0.2:
+                syllables *= 0  # pause
+            noise = rng.normal(0, 0.02, rate)
+            samples = (voice * syllables * 0.2 + noise) * 32767 * 0.5
+            f.writeframes(np.clip(samples, -32768, 32767).astype(np.int16).tobytes())
+
+
+def make_transcript(path: pathlib.Path, seconds: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = "лекция слайд функция матрица пример задача вывод модель данные метод".split()
+    segments = []
+    start = 0.0
+    while start < seconds:
+        end = start + float(rng.uniform(2, 6))
+        text = " ".join(rng.choice(words, int(rng.integers(5, 15)))).capitalize() + "."
+        segments.append({"start": start, "end": end, "text": text})
+        start = end
+    path.write_text(json.dumps(segments, ensure_ascii=False), encoding="utf-8")
+    return len(segments)
+
+
+class FakeObject:
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def read(self):
+        return self._data.read()
+
+    def stream(self, amt: int = 1024 ** 2):
+        while chunk := self._data.read(amt):
+            yield chunk
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeS3:
+    """Directory-backed stand-in for the Minio client methods the tasks use"""
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name: str) -> pathlib.Path:
+        return self.root / hashlib.sha256(name.encode()).hexdigest()
+
+    def _missing(self, name: str):
+        from minio.error import S3Error
+        return S3Error(response=None, code="NoSuchKey", message="missing", resource=name,
+                       request_id="", host_id="", object_name=name)
+
+    def stat_object(self, bucket: str, name: str):
+        path = self.path(name)
+        if not path.exists():
+            raise self._missing(name)
+        stat = path.stat()
+        return SimpleNamespace(etag=f"{stat.st_size}-{stat.st_mtime_ns}", size=stat.st_size)
+
+    def fget_object(self, bucket: str, name: str, file_path: str, **kwargs):
+        if not self.path(name).exists():
+            raise self._missing(name)
+        shutil.copyfile(self.path(name), file_path)
+
+    def fput_object(self, bucket: str, name: str, file_path: str, **kwargs):
+        shutil.copyfile(file_path, self.path(name))
+
+    def get_object(self, bucket: str, name: str, offset: int = 0, length: int = 0, **kwargs):
+        if not self.path(name).exists():
+            raise self._missing(name)
+        with self.path(name).open("rb") as f:
+            f.seek(offset)
+            return FakeObject(f.read(length or -1))
+
+    def put_object(self, bucket: str, name: str, data, length: int, **kwargs):
+        self.path(name).write_bytes(data.read(length))
+
+    def copy_object(self, bucket: str, name: str, source, **kwargs):
+        shutil.copyfile(self.path(source.object_name), self.path(name))
+
+    def remove_object(self, bucket: str, name: str, **kwargs):
+        self.path(name).unlink(missing_ok=True)
+
+    def presigned_get_object(self, bucket: str, name: str, **kwargs):
+        return str(self.path(name))
+
+    def list_objects(self, bucket: str, prefix: str | None = None, recursive: bool = False):
+        return []
+
+    def remove_objects(self, bucket: str, objects):
+        return []
+
+
+class FakeSession:
+    no_autoflush = contextlib.nullcontext()
+
+    async def flush(self):
+        pass
+
+
+class FakeStore:
+    def __init__(self):
+        self.files: list[SimpleNamespace] = []
+        self.notes: list[SimpleNamespace] = []
+
+
+STORE = FakeStore()
+
+
+class FakeFileRepository:
+    def __init__(self, session):
+        pass
+
+    async def create(self, user, project, name, file_type, file_size=0, task=None, **metadata):
+        file = SimpleNamespace(id=uuid.uuid4(), minio_name=f"files/{uuid.uuid4()}", name=name,
+                               file_type=file_type, **metadata)
+        STORE.files.append(file)
+        return file
+
+    async def get_active_images(self, project):
+        return [i for i in STORE.files if getattr(i, "metadata_text", None) is not None]
+
+
+class FakeProjectRepository:
+    def __init__(self, session):
+        pass
+
+    async def add_transcription_file(self, project, file):
+        project.transcription = file
+
+    async def add_summary_file(self, project, file):
+        project.summary = file
+
+    async def frames_extracted_done(self, project):
+        pass
+
+
+class FakeNoteRepository:
+    def __init__(self, session):
+        pass
+
+    async def get_by_file(self, file):
+        return STORE.notes
+
+
+class FakeCompletions:
+    """Streams a fixed-size answer with a configurable first-token delay and token rate"""
+
+    def __init__(self, first_token: float, tokens_per_second: float, tokens: int):
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.emitted = 0
+
+    async def create(self, model, messages, **kwargs):
+        prompt_tokens = sum(len(i["content"]) for i in messages) // 3
+
+        async def stream():
+            await asyncio.sleep(self.first_token)
+            for n in range(self.tokens):
+                if n and n % 50 == 0:
+                    await asyncio.sleep(50 / self.tokens_per_second)
+                self.emitted += 1
+                content = "![](0001.png) " if n == 0 else "слово "
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+            yield SimpleNamespace(usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=self.tokens),
+                                  choices=[])
+        return stream()
+
+
+def peak_rss_mb() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+async def run_scenario(args, work: pathlib.Path) -> dict:
+    from deva_p1_db.enums.task_type import TaskType
+    from config import settings
+    # app imports the models of the configured task type only
+    settings.task_type = {"transcribe": TaskType.transcribe, "frames_extract": TaskType.frames_extract,
+                          "summary": TaskType.summary}[args.scenario]
+    import deva_transcript.app as app
+    from deva_transcript.metrics import track_task
+    from deva_transcript.neural import summary as summary_module
+    from deva_transcript.neural import transcribe
+    from deva_transcript.progress import ProgressReporter
+
+    app.FileRepository = FakeFileRepository
+    app.ProjectRepository = FakeProjectRepository
+    app.NoteRepository = FakeNoteRepository
+    app.resolve_file_type = lambda file_type: SimpleNamespace(extension=file_type)
+
+    s3 = FakeS3(work / "bucket")
+    broker = SimpleNamespace(publish=lambda *a, **kw: asyncio.sleep(0))
+    logger = SimpleNamespace(info=lambda *a, **kw: None, warning=lambda *a, **kw: None, error=lambda *a, **kw: None)
+    project = SimpleNamespace(origin_file=None, transcription=None, summary=None)
+    task_model = SimpleNamespace(id=uuid.uuid4(), user=None, project=project, prompt="Подробный конспект")
+    result: dict = {"scenario": args.scenario}
+
+    if args.scenario == "transcribe":
+        source = work / "speech.wav"
+        if args.audio:
+            shutil.copyfile(args.audio, source)
+        else:
+            make_speech_like_audio(source, args.audio_seconds)
+        project.origin_file = SimpleNamespace(minio_name="source/speech", file_type=".wav")
+        s3.fput_object("", project.origin_file.minio_name, str(source))
+        with wave.open(str(source)) as f:
+            audio_seconds = f.getnframes() / f.getframerate()
+        load_start = time.perf_counter()
+        transcribe.load_whisper_model()
+        result["model_load_seconds"] = round(time.perf_counter() - load_start, 3)
+        task = app.task_transcribe
+        result["audio_seconds"] = audio_seconds
+        result["profile"] = transcribe.resolve_profile(args.profile).name
+    elif args.scenario == "frames_extract":
+        from frames_extract_scaling import make_slide_video
+        source = work / "slides.mp4"
+        if args.video:
+            shutil.copyfile(args.video, source)
+        else:
+            make_slide_video(source, args.video_seconds, args.width, args.height, args.slide_seconds)
+        project.origin_file = SimpleNamespace(minio_name="source/slides", file_type=".mp4")
+        s3.fput_object("", project.origin_file.minio_name, str(source))
+        import av
+        media = app.probe_media(source)
+        task = app.frames_extract_task
+        result["video_seconds"] = media.duration
+        # Only keyframes are decoded (skip_frame=NONKEY); counted from packets, without decoding
+        with av.open(str(source)) as container:
+            result["keyframes"] = sum(1 for packet in container.demux(video=0) if packet.is_keyframe)
+    else:
+        transcript = work / "transcript.json"
+        result["segments"] = make_transcript(transcript, args.audio_seconds)
+        project.origin_file = SimpleNamespace(minio_name="source/lecture", file_type=".mp4")
+        project.transcription = SimpleNamespace(minio_name="files/transcript")
+        s3.fput_object("", project.transcription.minio_name, str(transcript))
+        for n in range(args.audio_seconds // 60):
+            STORE.files.append(SimpleNamespace(id=uuid.uuid4(), metadata_timecode=n * 60.0, metadata_text=f"Слайд {n}"))
+            STORE.notes.append(SimpleNamespace(text=f"Заметка {n}", start_time_code=n * 60.0 + 30))
+        completions = FakeCompletions(args.llm_first_token, args.llm_tokens_per_second, args.llm_tokens)
+        summary_module.OPENAI_API = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        task = app.task_summary
+
+    start = time.perf_counter()
+    with track_task() as timings:
+        reporter = ProgressReporter(broker, task_model.id)
+        if args.scenario == "transcribe":
+            await task(task_model, FakeSession(), s3, logger, reporter, args.profile)
+        else:
+            await task(task_model, FakeSession(), s3, logger, reporter)
+    wall = time.perf_counter() - start
+
+    result["wall_seconds"] = round(wall, 3)
+    result["stages"] = {k: round(v, 3) for k, v in timings.items()}
+    result["peak_rss_mb"] = peak_rss_mb()
+    if args.scenario == "transcribe":
+        result["audio_seconds_per_second"] = round(result["audio_seconds"] / wall, 2)
+    elif args.scenario == "frames_extract":
+        result["keyframes_per_second"] = round(result["keyframes"] / wall, 1)
+        result["video_seconds_per_second"] = round(result["video_seconds"] / wall, 1)
+        result["slides"] = sum(1 for i in STORE.files if i.name.endswith(".png"))
+    else:
+        result["llm_tokens_per_second"] = round(completions.emitted / wall, 1)
+    return result
+
+
+def child(args):
+    work = pathlib.Path(tempfile.mkdtemp(prefix="deva_bench_"))
+    # Measure the work itself: no caches, node-local state under the scratch directory
+    os.environ.update({
+        "RESULT_CACHE_ENABLED": "false",
+        "MEDIA_CACHE_ENABLED": "false",
+        "LLM_CACHE_ENABLED": "false",
+        "CHECKPOINT_DIR": str(work / "checkpoints"),
+        "WHISPER_MODEL_NAME": args.whisper_model,
+        "WHISPER_DRAFT_MODEL_NAME": args.whisper_model,
+        "METRICS_PORT": "0",
+    })
+    try:
+        result = asyncio.run(run_scenario(args, work))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def main(args, argv: list[str]):
+    for scenario in args.scenarios:
+        # A fresh interpreter per scenario keeps peak RSS and imports separate
+        process = subprocess.run([sys.executable, __file__, *argv, "--scenario", scenario],
+                                 stdout=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            print(json.dumps({"scenario": scenario, "error": process.returncode}))
+            continue
+        print(process.stdout.strip().splitlines()[-1], flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the worker tasks")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--audio", help="Use an existing 16 kHz WAV instead of synthetic speech")
+    parser.add_argument("--audio-seconds", type=int, default=300)
+    parser.add_argument("--whisper-model", default="tiny")
+    parser.add_argument("--profile", choices=("draft", "standard", "accurate"))
+    parser.add_argument("--video", help="Use an existing video instead of a synthetic slide deck")
+    parser.add_argument("--video-seconds", type=int, default=600)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--slide-seconds", type=int, default=20)
+    parser.add_argument("--llm-first-token", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50)
+    parser.add_argument("--llm-tokens", type=int, default=500)
+    parsed = parser.parse_args()
+    if parsed.scenario:
+        child(parsed)
+    else:
+        main(parsed, sys.argv[1:])
@@ -1,5 +1,6 @@
 from enum import Enum
 import os
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from deva_p1_db.enums.task_type import TaskType
@@ -26,16 +27,66 @@ class Settings(BaseSettings):
     minio_secret_key: str = "minioadmin"
     minio_bucket: str = "my-bucket"
     minio_secure: bool = False
+    upload_concurrency: int = 8
+    db_batch_size: int = 32
+    s3_max_connections: int = 32
+    s3_part_size: int = 64 * 1024 ** 2  # multipart minimum is 5 MiB
+    s3_transfer_concurrency: int = 4
+
+    result_cache_enabled: bool = True
+    result_cache_prefix: str = "cache/"
+    result_cache_max_bytes: int = 50 * 1024 ** 3
+
+    media_cache_enabled: bool = True
+    media_cache_dir: str = "/tmp/deva_media_cache"
+    media_cache_max_bytes: int = 20 * 1024 ** 3
+    media_cache_link: Literal["hardlink", "copy"] = "hardlink"
 
     task_type: TaskType = TaskType.transcribe
 
+    worker_max_tasks: int = 1
+    worker_prefetch_count: int = 1
+    worker_cpu_threads: int = 1
+    worker_io_threads: int = 8
+    worker_warmup: bool = True
+    progress_min_interval: float = 1
+    progress_min_delta: float = 0.01
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 0
+
+    frames_dedup_threshold: float = 10
+    frames_workers: int = 0
+    frames_chunk_seconds: float = 300
+    frames_combined_extraction: bool = False
+
     whisper_model_name: str = "large-v3"
+    whisper_draft_model_name: str = "small"
+    whisper_profile: Literal["draft", "standard", "accurate"] = "accurate"
+    whisper_pool_max_bytes: int = 4 * 1024 ** 3
     whisper_device: str = "cpu"
     whisper_cpu_threads: int = 0
+    whisper_batch_size: int = 0
+    transcript_format: Literal["json", "jsonl", "columnar"] = "json"
+    transcribe_streaming: bool = False
+    whisper_stream_window: float = 600
+
+    checkpoint_dir: str = "/tmp/deva_checkpoints"
+    checkpoint_interval: float = 30
+    checkpoint_max_age: float = 86400
 
     openai_api_key: str = ""
     openai_api_model_name: str = ""
     openai_base_url: str = ""
+    # Section budget; sections are also the unit an edit regenerates, 0 summarizes in one call
+    summary_chunk_tokens: int = 4000
+    summary_concurrency: int = 4
+    # Merges section summaries into one text; edits still reuse the unchanged section summaries
+    summary_reduce: bool = True
+
+    llm_cache_enabled: bool = True
+    llm_cache_path: str = "/tmp/deva_llm_cache.sqlite3"
+    llm_cache_ttl: float = 7 * 86400
+    llm_cache_max_bytes: int = 512 * 1024 ** 2
     
 
 settings = Settings()
@@ -1,35 +1,63 @@
-import json
+import asyncio
+import contextlib
 import pathlib
 import time
+from datetime import timedelta
 from faststream import FastStream, Logger
-from faststream.rabbit import RabbitBroker
+from faststream.rabbit import Channel, RabbitBroker
+from faststream.rabbit.annotations import RabbitMessage
 
 from deva_p1_db.repositories import TaskRepository, FileRepository, ProjectRepository, NoteRepository
 from deva_p1_db.enums.task_type import TaskType
 from deva_p1_db.enums.rabbit import RabbitQueuesToAi, RabbitQueuesToBack
 from deva_p1_db.models import Task
 from deva_p1_db.enums.file_type import FileTypes, resolve_file_type
-from openai import project
 
+from deva_transcript.checkpoint import TranscriptCheckpoint, prune_checkpoints
 from deva_transcript.database import Session
-from deva_transcript.neural.frames_extract import extract_unique_slides, get_video_stat
-from deva_transcript.neural.summary import create_summary, load_openai_model
-from deva_transcript.neural.transcribe import load_whisper_model, transcribe_audio
-from deva_transcript.neural.utils import extract_audio_and_convert, extract_key_frames, generate_prompt
-from deva_transcript.s3 import S3_client
-from deva_p1_db.schemas.task import TaskToAi, TaskReadyToBack, TaskStatusToBack, TaskErrorToBack
+from deva_transcript.executor import TASK_LIMIT, get_process_executor, iterate_cpu, run_cpu, run_in, run_io, shutdown
+from deva_transcript.llm_cache import LLM_CACHE_STATS
+from deva_transcript.media_cache import MEDIA_CACHE
+from deva_transcript.metrics import (AUDIO_SECONDS, REALTIME_FACTOR, SLIDES, SLIDES_PER_MINUTE, StatsCollector,
+                                     format_timings, mark_ready, record_stage, stage, start_metrics_server, track_task)
+from deva_transcript.neural.transcript_io import EXTENSIONS as TRANSCRIPT_EXTENSIONS, open_transcript_writer, read_transcript
+from deva_transcript.neural.utils import generate_sections
+from deva_transcript.progress import PROGRESS_STATS, ProgressReporter
+from deva_transcript.provenance import delete_provenance, load_provenance, save_provenance
+from deva_transcript.result_cache import RESULT_CACHE_STATS, CachedFile, ResultCache
+from deva_transcript.s3 import S3_client, download_file, upload_file
+from deva_transcript.uploads import BulkUploader
+from deva_p1_db.schemas.task import TaskToAi, TaskReadyToBack, TaskErrorToBack
 from config import settings
 
 import tempfile
 
+# Only the models and media libraries of the served task type are imported:
+# openai and faster_whisper alone take over a second, PyAV and numpy are not needed for summaries
+if settings.task_type == TaskType.transcribe:
+    from deva_transcript.neural.media import CONVERTED_AUDIO, extract_audio_and_convert, probe_media, stream_audio_pcm
+    from deva_transcript.neural.transcribe import (load_whisper_model, resolve_profile, transcribe_audio,
+                                                   transcribe_params, transcribe_stream, warm_up_whisper)
+if settings.task_type == TaskType.summary:
+    from deva_transcript.neural.summary import CompletionStats, create_summary, load_openai_model, warm_up_openai
+if settings.task_type == TaskType.frames_extract:
+    from deva_transcript.neural.media import CONVERTED_AUDIO, extract_audio_and_key_frames, iter_key_frames, probe_media
+    from deva_transcript.neural.frames_extract import (extract_unique_slides, extract_unique_slides_parallel,
+                                                       slides_params, warm_up_frames)
+
 broker = RabbitBroker(
     url=f"amqp://{settings.rabbit_user}:{settings.rabbit_password}@{settings.rabbit_ip}:{settings.rabbit_port}/",
     host=settings.rabbit_ip,
-    port=settings.rabbit_port
-
+    port=settings.rabbit_port,
+    default_channel=Channel(prefetch_count=settings.worker_prefetch_count)
 )
 app = FastStream(broker)
 
+StatsCollector("deva_result_cache_total", "Result cache operations", RESULT_CACHE_STATS)
+StatsCollector("deva_llm_cache_total", "LLM response cache operations", LLM_CACHE_STATS)
+StatsCollector("deva_progress_updates_total", "Progress updates by outcome", PROGRESS_STATS)
+METRICS_SERVER: asyncio.Server | None = None
+
 
 working_queue = {
     TaskType.transcribe: RabbitQueuesToAi.transcribe_task,
@@ -38,53 +66,125 @@ working_queue = {
 }
 
 
-async def task_transcribe(task_model: Task, session: Session, s3: S3_client, logger: Logger):
+async def task_transcribe(task_model: Task, session: Session, s3: S3_client, logger: Logger, progress: ProgressReporter,
+                          profile_name: str | None = None):
     file_repository = FileRepository(session)
     project_repository = ProjectRepository(session)
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        temp_dir = pathlib.Path(tmp_dir)
-        source_file = task_model.project.origin_file
-
-        if source_file is None:
-            raise Exception("Source file not found")
-        input_type = resolve_file_type(source_file.file_type)
-
-        input_path = temp_dir / f"input{input_type.extension}"
-        converted_path = temp_dir / "converted.wav"
-        output_path = temp_dir / "output.json"
+    source_file = task_model.project.origin_file
+    if source_file is None:
+        raise Exception("Source file not found")
+    extension = TRANSCRIPT_EXTENSIONS[settings.transcript_format]
+    transcript_name = f"transcript{extension}"
+    profile = resolve_profile(profile_name)
+    logger.info(f"Task {task_model.id} uses the {profile.name} profile ({profile.model}, beam {profile.beam_size})")
 
-        s3.fget_object(settings.minio_bucket,
-                       source_file.minio_name, str(input_path))
-
-        await extract_audio_and_convert(input_path, converted_path)
-        for i in transcribe_audio(converted_path, output_path):
-            await broker.publish(TaskStatusToBack(task_id=task_model.id, progress=i[0] / i[1]), RabbitQueuesToBack.progress_task)
+    try:
+        # Checkpoints of tasks that died without reporting an error and were never redelivered
+        await run_io(prune_checkpoints, s3)
+    except Exception as e:
+        logger.warning(f"Checkpoint pruning failed: {e}")
 
+    cache = ResultCache(s3, logger=logger)
+    cache_key = await cache.key(source_file.minio_name, transcribe_params(profile))
+    if await cache.get(cache_key) is not None:
+        logger.info(f"Task {task_model.id} served from result cache")
         new_file = await file_repository.create(
             task_model.user,
             task_model.project,
-            "transcript.json",
+            transcript_name,
             FileTypes.text_json.internal,
             file_size=0,
             task=task_model
         )
         if new_file is None:
             raise Exception("File not created")
-        s3.fput_object(settings.minio_bucket,
-                       new_file.minio_name,
-                       str(output_path),
-                       content_type=FileTypes.text_json.mime)
-
+        await cache.copy(cache_key, transcript_name, new_file.minio_name)
         await project_repository.add_transcription_file(task_model.project, new_file)
+        return
 
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        temp_dir = pathlib.Path(tmp_dir)
+        input_type = resolve_file_type(source_file.file_type)
 
-async def task_summary(task_model: Task, session: Session, s3: S3_client, logger: Logger):
+        input_path = temp_dir / f"input{input_type.extension}"
+        output_path = temp_dir / f"output{extension}"
+
+        checkpoint = TranscriptCheckpoint(task_model.id, s3)
+        try:
+            done = await checkpoint.restore()
+            if done:
+                logger.info(f"Task {task_model.id} resumed from {done[-1]['end']:.2f} seconds")
+
+            writer = open_transcript_writer(output_path, settings.transcript_format)
+            if settings.transcribe_streaming:
+                # ffmpeg reads the object over HTTP and pipes PCM out, nothing is written to disk
+                url = await run_io(s3.presigned_get_object, settings.minio_bucket,
+                                   source_file.minio_name, expires=timedelta(hours=12))
+                media = await run_io(probe_media, url)
+                pcm = stream_audio_pcm(url, done[-1]["end"] if done else 0.0)
+                segments = transcribe_stream(pcm, media.duration, writer, profile, done)
+            else:
+                converted_path = checkpoint.audio_path
+                if not converted_path.exists():
+                    partial_path = converted_path.with_suffix(".part.wav")
+                    # A frames worker on this node may have already decoded the audio in its combined pass
+                    if not await MEDIA_CACHE.fetch_derived(s3, source_file.minio_name, CONVERTED_AUDIO, partial_path):
+                        with stage("download"):
+                            await MEDIA_CACHE.fetch(s3, source_file.minio_name, input_path)
+                        with stage("convert"):
+                            await extract_audio_and_convert(input_path, partial_path)
+                    partial_path.rename(converted_path)
+                segments = transcribe_audio(converted_path, writer, profile, done)
+
+            resumed_from = done[-1]["end"] if done else 0.0
+            transcribed_until = resumed_from
+            inference_start = time.perf_counter()
+            try:
+                with stage("inference"):
+                    async for i in iterate_cpu(segments):
+                        checkpoint.append(i[2])
+                        progress.update(i[0] / i[1])
+                        transcribed_until = i[0]
+            finally:
+                await checkpoint.close()
+            AUDIO_SECONDS.inc(transcribed_until - resumed_from)
+            REALTIME_FACTOR.set((transcribed_until - resumed_from) / max(time.perf_counter() - inference_start, 1e-9))
+
+            with stage("db"):
+                new_file = await file_repository.create(
+                    task_model.user,
+                    task_model.project,
+                    transcript_name,
+                    FileTypes.text_json.internal,
+                    file_size=0,
+                    task=task_model
+                )
+            if new_file is None:
+                raise Exception("File not created")
+            with stage("upload"):
+                await run_io(upload_file, s3, new_file.minio_name, output_path, FileTypes.text_json.mime,
+                             metadata={"profile": profile.name, "model": profile.model})
+
+            with stage("db"):
+                await project_repository.add_transcription_file(task_model.project, new_file)
+        except Exception:
+            # The error is reported and the message acked, so nothing would ever resume this checkpoint
+            with contextlib.suppress(Exception):
+                await checkpoint.clear()
+            raise
+        await checkpoint.clear()
+        await cache.put(cache_key, [({"name": transcript_name, "timecode": None}, new_file.minio_name)])
+
+
+async def task_summary(task_model: Task, session: Session, s3: S3_client, logger: Logger, progress: ProgressReporter,
+                       incremental: bool = False):
+    """With incremental, sections whose inputs did not change since the current summary are reused"""
     file_repository = FileRepository(session)
     project_repository = ProjectRepository(session)
     note_repository = NoteRepository(session)
 
     with tempfile.TemporaryDirectory() as tmp_dir:
-        input_path = pathlib.Path(tmp_dir) / "input.json"
+        input_path = pathlib.Path(tmp_dir) / "input.transcript"
         output_path = pathlib.Path(tmp_dir) / "output.md"
         transcript_file = task_model.project.transcription
         if transcript_file is None:
@@ -92,99 +192,187 @@ async def task_summary(task_model: Task, session: Session, s3: S3_client, logger
         if task_model.project.origin_file is None:
             raise Exception("Source file not found")
 
-        s3.fget_object(settings.minio_bucket,
-                       transcript_file.minio_name, str(input_path))
-
-        images = await file_repository.get_active_images(task_model.project)
-        notes = await note_repository.get_by_file(task_model.project.origin_file)
-
-        content_prompt, image_mapping = generate_prompt(
-            json.load(open(input_path)), notes, images)
-        logger.info("Content Prompt:\n" + content_prompt)
-        summary = create_summary(
-            task_model.prompt, content_prompt, output_path)
+        with stage("download"):
+            await run_io(download_file, s3, transcript_file.minio_name, input_path)
+
+        with stage("db"):
+            images = await file_repository.get_active_images(task_model.project)
+            notes = await note_repository.get_by_file(task_model.project.origin_file)
+
+        replaced = task_model.project.summary
+        provenance = None
+        if incremental and replaced is not None:
+            provenance = await load_provenance(s3, replaced.minio_name)
+            if provenance is None:
+                logger.info(f"Task {task_model.id} has no section provenance, summarizing from scratch")
+        bounds = None if provenance is None else [i["start"] for i in provenance["sections"]]
+
+        with stage("prompt"):
+            sections, image_mapping = await run_cpu(
+                generate_sections, read_transcript(input_path), notes, images, settings.summary_chunk_tokens, bounds)
+        previous: list[str | None] = ["" if not i.text.strip() else None for i in sections]
+        if provenance is not None and provenance["model"] == settings.openai_api_model_name \
+                and provenance["prompt"] == task_model.prompt:
+            previous = [old["summary"] if old["digest"] == new.digest else summary
+                        for old, new, summary in zip(provenance["sections"], sections, previous)]
+        logger.info(f"Task {task_model.id} summarizes {previous.count(None)} of {len(sections)} sections")
+        logger.info("Content Prompt:\n" + "".join(i.text for i in sections))
+        stats = CompletionStats()
+        start_time = time.time()
+        with stage("llm"):
+            summary, section_summaries = await create_summary(
+                task_model.prompt, [i.text for i in sections], output_path, stats, progress.update, previous)
+        first_token = "-" if stats.first_token is None else f"{stats.first_token:.2f}s"
+        logger.info(f"Task {task_model.id} summary generated in {time.time() - start_time:.2f} seconds, "
+                    f"first token {first_token}, {stats.prompt_tokens} prompt / {stats.completion_tokens} completion tokens, "
+                    f"LLM cache: {stats.cached} of {stats.calls} calls")
 
         if summary is None:
             raise Exception("Summary not generated")
 
         for k, v in image_mapping.items():
             summary = summary.replace(k, str(v))
+            if section_summaries is not None:
+                section_summaries = [i.replace(k, str(v)) for i in section_summaries]
 
         with output_path.open(mode="w", encoding="utf-8") as f:
             f.write(summary)
             f.flush()
 
-        new_file = await file_repository.create(
-            task_model.user,
-            task_model.project,
-            "summary.md",
-            FileTypes.text_md.internal,
-            file_size=0,
-            task=task_model
-        )
+        with stage("db"):
+            new_file = await file_repository.create(
+                task_model.user,
+                task_model.project,
+                "summary.md",
+                FileTypes.text_md.internal,
+                file_size=0,
+                task=task_model
+            )
         if new_file is None:
             raise Exception("File not created")
-        s3.fput_object(settings.minio_bucket,
-                       new_file.minio_name,
-                       str(output_path),
-                       content_type=FileTypes.text_md.mime)
-
-        await project_repository.add_summary_file(task_model.project, new_file)
-
-
-async def frames_extract_task(task_model: Task, session: Session, s3: S3_client, logger: Logger):
+        with stage("upload"):
+            await run_io(upload_file, s3, new_file.minio_name, output_path, FileTypes.text_md.mime)
+            if section_summaries is not None:
+                # The map output, not the reduced text: an edit reuses it and reduces again
+                await save_provenance(s3, new_file.minio_name, {
+                    "model": settings.openai_api_model_name,
+                    "prompt": task_model.prompt,
+                    "sections": [{"start": i.start, "end": i.end, "digest": i.digest, "summary": summary}
+                                 for i, summary in zip(sections, section_summaries)]
+                })
+
+        with stage("db"):
+            await project_repository.add_summary_file(task_model.project, new_file)
+        if replaced is not None:
+            try:
+                # Only the current summary can be edited, older sidecars would pile up
+                await delete_provenance(s3, replaced.minio_name)
+            except Exception as e:
+                logger.warning(f"Provenance of {replaced.minio_name} not removed: {e}")
+
+
+async def register_images(images: list[tuple[float, str, pathlib.Path | str]], task_model: Task, session: Session,
+                          uploader: BulkUploader, registered: list[tuple[CachedFile, str]]):
     file_repository = FileRepository(session)
-    project_repository = ProjectRepository(session)
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        temp_dir = pathlib.Path(tmp_dir)
-
-        source_file = task_model.project.origin_file
-        if source_file is None:
-            raise Exception("Source file not found")
-        input_type = resolve_file_type(source_file.file_type)
-
-        input_path = temp_dir / f"input{input_type.extension}"
-        converted_dir = temp_dir / "frames"
-        output_dir = temp_dir / "images"
-
-        converted_dir.mkdir(exist_ok=True)
-        output_dir.mkdir(exist_ok=True)
-
-        s3.fget_object(settings.minio_bucket,
-                       source_file.minio_name, str(input_path))
-
-        await extract_key_frames(input_path, converted_dir)
-
-        last_time = time.time()
-
-        images: list[tuple[float, pathlib.Path]] = []
-
-        for i in extract_unique_slides(converted_dir, output_dir, *get_video_stat(input_path)):
-            if time.time() - last_time > 3:
-                await broker.publish(
-                    TaskStatusToBack(task_id=task_model.id, progress=i[0] / i[1]), RabbitQueuesToBack.progress_task)
-            images.append((i[0], i[2]))
-
-        for i in images:
+    files = []
+    # One flush per batch instead of per row; uploads start once minio names are assigned
+    with stage("db"), session.no_autoflush:
+        for timecode, name, source in images:
             new_file = await file_repository.create(
                 task_model.user,
                 task_model.project,
-                i[1].name,
+                name,
                 FileTypes.image_png.internal,
                 file_size=0,
                 task=task_model,
-                metadata_timecode=i[0],
+                metadata_timecode=timecode,
                 metadata_is_hide=False,
                 metadata_text=""
             )
             if new_file is None:
                 raise Exception("File not created")
-            s3.fput_object(settings.minio_bucket,
-                           new_file.minio_name,
-                           str(i[1]),
-                           content_type=FileTypes.image_png.mime)
+            files.append((timecode, name, new_file, source))
+        await session.flush()
+    for timecode, name, new_file, source in files:
+        uploader.submit(new_file.minio_name, source, FileTypes.image_png.mime)
+        registered.append(({"name": name, "timecode": timecode}, new_file.minio_name))
+    images.clear()
 
+
+async def frames_extract_task(task_model: Task, session: Session, s3: S3_client, logger: Logger, progress: ProgressReporter):
+    project_repository = ProjectRepository(session)
+    source_file = task_model.project.origin_file
+    if source_file is None:
+        raise Exception("Source file not found")
+
+    images: list[tuple[float, str, pathlib.Path | str]] = []
+    registered: list[tuple[CachedFile, str]] = []
+
+    cache = ResultCache(s3, logger=logger)
+    cache_key = await cache.key(source_file.minio_name, slides_params())
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Task {task_model.id} served from result cache")
+        async with BulkUploader(s3) as uploader:
+            for i in cached:
+                images.append((i["timecode"] or 0.0, i["name"], cache.object_name(cache_key, i["name"])))
+                if len(images) >= settings.db_batch_size:
+                    await register_images(images, task_model, session, uploader, registered)
+            await register_images(images, task_model, session, uploader, registered)
         await project_repository.frames_extracted_done(task_model.project)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        temp_dir = pathlib.Path(tmp_dir)
+        input_type = resolve_file_type(source_file.file_type)
+
+        input_path = temp_dir / f"input{input_type.extension}"
+        output_dir = temp_dir / "images"
+
+        output_dir.mkdir(exist_ok=True)
+
+        with stage("download"):
+            await MEDIA_CACHE.fetch(s3, source_file.minio_name, input_path)
+
+        media = await run_io(probe_media, input_path)
+        audio_path = temp_dir / "audio.wav"
+        combined = settings.frames_combined_extraction and media.has_audio
+        if settings.frames_workers > 1:
+            combined = False
+            slides = extract_unique_slides_parallel(
+                input_path, output_dir, media.duration, get_process_executor(), settings.frames_workers)
+        elif combined:
+            slides = extract_unique_slides(
+                extract_audio_and_key_frames(input_path, audio_path), output_dir, media.duration)
+        else:
+            slides = extract_unique_slides(
+                iter_key_frames(input_path), output_dir, media.duration)
+
+        extract_start = time.perf_counter()
+        async with BulkUploader(s3) as uploader:
+            # Extraction and dedup run in the executor; the extract timer is paused
+            # around register_images, which is reported as db
+            extract_seconds = 0.0
+            resumed = time.perf_counter()
+            async for i in iterate_cpu(slides):
+                progress.update(i[0] / i[1])
+                images.append((i[0], i[2].name, i[2]))
+                if len(images) >= settings.db_batch_size:
+                    extract_seconds += time.perf_counter() - resumed
+                    await register_images(images, task_model, session, uploader, registered)
+                    resumed = time.perf_counter()
+            record_stage("extract", extract_seconds + time.perf_counter() - resumed)
+            await register_images(images, task_model, session, uploader, registered)
+            with stage("upload"):
+                await uploader.wait()
+        SLIDES.inc(len(registered))
+        SLIDES_PER_MINUTE.set(len(registered) * 60 / max(time.perf_counter() - extract_start, 1e-9))
+        if combined:
+            await MEDIA_CACHE.store_derived(s3, source_file.minio_name, CONVERTED_AUDIO, audio_path)
+
+        with stage("db"):
+            await project_repository.frames_extracted_done(task_model.project)
+        await cache.put(cache_key, registered)
 
 
 @broker.subscriber(working_queue[settings.task_type])
@@ -192,30 +380,39 @@ async def frames_extract_task(task_model: Task, session: Session, s3: S3_client,
 async def handle(task: TaskToAi,
                  session: Session,
                  s3: S3_client,
-                 logger: Logger):
+                 logger: Logger,
+                 message: RabbitMessage):
     task_repository = TaskRepository(session)
 
     task_model = await task_repository.get_by_id(task.task_id)
     if task_model is None:
         raise Exception("Task not found")
-    logger.info(f"Task {task.task_id} started")
-    start_time = time.time()
-    try:
-        if settings.task_type == TaskType.transcribe:
-            await task_transcribe(task_model, session, s3, logger)
-        if settings.task_type == TaskType.summary:
-            await task_summary(task_model, session, s3, logger)
-        if settings.task_type == TaskType.frames_extract:
-            await frames_extract_task(task_model, session, s3, logger)
-    except Exception as e:
-        logger.error(f"Task {task.task_id} failed: {e}")
-        await broker.publish(TaskErrorToBack(task_id=task.task_id, error=str(e)), RabbitQueuesToBack.error_task)
+    async with TASK_LIMIT:
+        logger.info(f"Task {task.task_id} started")
+        start_time = time.time()
+        progress = ProgressReporter(broker, task.task_id)
+        try:
+            with track_task() as timings:
+                if settings.task_type == TaskType.transcribe:
+                    # Decoding profile is chosen per message: draft for previews, accurate for archives
+                    await task_transcribe(task_model, session, s3, logger, progress, message.headers.get("profile"))
+                if settings.task_type == TaskType.summary:
+                    await task_summary(task_model, session, s3, logger, progress)
+                if settings.task_type == TaskType.frames_extract:
+                    await frames_extract_task(task_model, session, s3, logger, progress)
+            await progress.finish()
+            logger.info(f"Task {task.task_id} stages: {format_timings(timings)}")
+        except Exception as e:
+            await progress.close()
+            logger.error(f"Task {task.task_id} failed: {e}")
+            await broker.publish(TaskErrorToBack(task_id=task.task_id, error=str(e)), RabbitQueuesToBack.error_task)
 
     task_model.done = True
     await session.flush()
 
     logger.info(
-        f"Task {task.task_id} end in {time.time() - start_time:.2f} seconds")
+        f"Task {task.task_id} end in {time.time() - start_time:.2f} seconds, "
+        f"progress updates: {progress.sent} sent, {progress.dropped} dropped")
     return TaskReadyToBack(task_id=task.task_id)
 
 if settings.task_type == TaskType.summary:
@@ -230,10 +427,19 @@ if settings.task_type == TaskType.summary:
         task_model = await task_repository.get_by_id(task.task_id)
         if task_model is None:
             raise Exception("Task not found")
-        logger.info(f"Task {task.task_id} started")
-        start_time = time.time()
-
-        pass  # TODO
+        async with TASK_LIMIT:
+            logger.info(f"Task {task.task_id} started")
+            start_time = time.time()
+            progress = ProgressReporter(broker, task.task_id)
+            try:
+                with track_task() as timings:
+                    await task_summary(task_model, session, s3, logger, progress, incremental=True)
+                await progress.finish()
+                logger.info(f"Task {task.task_id} stages: {format_timings(timings)}")
+            except Exception as e:
+                await progress.close()
+                logger.error(f"Task {task.task_id} failed: {e}")
+                await broker.publish(TaskErrorToBack(task_id=task.task_id, error=str(e)), RabbitQueuesToBack.error_task)
 
         task_model.done = True
         await session.flush()
@@ -243,9 +449,37 @@ if settings.task_type == TaskType.summary:
         return TaskReadyToBack(task_id=task.task_id)
 
 
-@app.after_startup
+@app.on_startup
 async def load_model():
+    """Runs before the broker connects, so no message is taken until the model is loaded and warmed up"""
+    global METRICS_SERVER
+    METRICS_SERVER = await start_metrics_server()
+    start_time = time.time()
     if settings.task_type == TaskType.transcribe:
         load_whisper_model()
+        prune_checkpoints()
+        if settings.worker_warmup:
+            # In the executor that runs inference: per-thread allocator state is warmed too
+            await run_cpu(warm_up_whisper)
     if settings.task_type == TaskType.summary:
         load_openai_model()
+        if settings.worker_warmup:
+            await warm_up_openai()
+    if settings.task_type == TaskType.frames_extract and settings.worker_warmup:
+        await run_cpu(warm_up_frames)
+        if settings.frames_workers > 1:
+            executor = get_process_executor()
+            await asyncio.gather(*(run_in(executor, warm_up_frames) for _ in range(settings.frames_workers)))
+    app.logger.info(f"Worker {settings.task_type} loaded in {time.time() - start_time:.2f} seconds")
+
+
+@app.after_startup
+async def report_ready():
+    mark_ready()
+
+
+@app.after_shutdown
+async def shutdown_executors():
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.close()
+    shutdown()
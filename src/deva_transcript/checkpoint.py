@@ -0,0 +1,101 @@
+import asyncio
+import json
+import pathlib
+import shutil
+import time
+from uuid import UUID
+
+from minio import Minio
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+from config import settings
+from deva_transcript.executor import run_io
+from deva_transcript.neural.utils import TranscriptEntry
+
+
+class TranscriptCheckpoint:
+    def __init__(self, task_id: UUID, s3: Minio):
+        self.s3 = s3
+        self.dir = pathlib.Path(settings.checkpoint_dir) / str(task_id)
+        self.segments_path = self.dir / "segments.jsonl"
+        self.audio_path = self.dir / "converted.wav"
+        self.object_name = f"checkpoints/{task_id}.jsonl"
+        self._file = None
+        self._upload: asyncio.Task | None = None
+        self._last_commit = time.time()
+
+    async def restore(self) -> list[TranscriptEntry]:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if not self.segments_path.exists():
+            try:
+                await run_io(self.s3.fget_object, settings.minio_bucket,
+                             self.object_name, str(self.segments_path))
+            except S3Error as e:
+                if e.code != "NoSuchKey":
+                    raise
+        segments: list[TranscriptEntry] = []
+        if self.segments_path.exists():
+            with self.segments_path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        segments.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Last line may be cut by a crash mid-write
+                        break
+            # Rewrite without a torn tail so new lines append cleanly
+            with self.segments_path.open("w", encoding="utf-8") as f:
+                for segment in segments:
+                    f.write(json.dumps(segment, ensure_ascii=False) + "\n")
+        self._file = self.segments_path.open("a", encoding="utf-8")
+        return segments
+
+    def append(self, segment: TranscriptEntry):
+        if self._file is None:
+            raise Exception("Checkpoint is not restored")
+        self._file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if time.time() - self._last_commit > settings.checkpoint_interval:
+            self.commit()
+
+    def commit(self):
+        if self._upload is not None and not self._upload.done():
+            return
+        self._last_commit = time.time()
+        self._upload = asyncio.create_task(run_io(
+            self.s3.fput_object, settings.minio_bucket, self.object_name, str(self.segments_path)))
+
+    async def close(self):
+        if self._upload is not None:
+            await asyncio.gather(self._upload, return_exceptions=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def clear(self):
+        await self.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+        await run_io(self.s3.remove_object, settings.minio_bucket, self.object_name)
+
+
+def _last_modified(path: pathlib.Path) -> float:
+    # The directory mtime does not move while segments are appended
+    return max([path.stat().st_mtime] + [i.stat().st_mtime for i in path.iterdir()])
+
+
+def prune_checkpoints(s3: Minio | None = None, max_age: float = settings.checkpoint_max_age):
+    """Removes checkpoints of tasks nobody has resumed for max_age, with their bucket copies when s3 is given"""
+    root = pathlib.Path(settings.checkpoint_dir)
+    if root.exists():
+        for path in root.iterdir():
+            try:
+                if time.time() - _last_modified(path) > max_age:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                continue  # removed by a concurrent prune or clear
+    if s3 is None:
+        return
+    stale = [DeleteObject(i.object_name) for i in s3.list_objects(settings.minio_bucket, prefix="checkpoints/")
+             if i.last_modified is not None and time.time() - i.last_modified.timestamp() > max_age]
+    for error in s3.remove_objects(settings.minio_bucket, stale):
+        raise Exception(f"Stale checkpoint not removed: {error}")
@@ -0,0 +1,68 @@
+import asyncio
+import functools
+import multiprocessing
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import ParamSpec, TypeVar
+
+from config import settings
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Inference (whisper / opencv) releases the GIL inside native code, so a thread
+# pool shares the loaded model between tasks without pickling it into workers.
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.worker_cpu_threads, thread_name_prefix="cpu")
+IO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.worker_io_threads, thread_name_prefix="io")
+
+TASK_LIMIT = asyncio.Semaphore(settings.worker_max_tasks)
+
+# Created on first use: only frames workers with FRAMES_WORKERS > 1 need it.
+PROCESS_EXECUTOR: ProcessPoolExecutor | None = None
+
+_END = object()
+
+
+async def run_in(executor: Executor, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_cpu(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    return await run_in(CPU_EXECUTOR, func, *args, **kwargs)
+
+
+async def run_io(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    return await run_in(IO_EXECUTOR, func, *args, **kwargs)
+
+
+async def iterate_in(executor: Executor, iterator: Iterator[T]) -> AsyncIterator[T]:
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(executor, next, iterator, _END)
+        if item is _END:
+            return
+        yield item  # type: ignore
+
+
+def iterate_cpu(iterator: Iterator[T]) -> AsyncIterator[T]:
+    return iterate_in(CPU_EXECUTOR, iterator)
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    global PROCESS_EXECUTOR
+    if PROCESS_EXECUTOR is None:
+        # spawn: the worker process already runs threads, forking it is unsafe
+        PROCESS_EXECUTOR = ProcessPoolExecutor(
+            max_workers=settings.frames_workers,
+            mp_context=multiprocessing.get_context("spawn"))
+    return PROCESS_EXECUTOR
+
+
+def shutdown():
+    CPU_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    IO_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    if PROCESS_EXECUTOR is not None:
+        PROCESS_EXECUTOR.shutdown(wait=False, cancel_futures=True)
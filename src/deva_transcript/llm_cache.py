@@ -0,0 +1,107 @@
+import contextlib
+import hashlib
+import json
+import pathlib
+import sqlite3
+import time
+from collections.abc import Iterator
+
+from config import settings
+from deva_transcript.executor import run_io
+from deva_transcript.result_cache import CacheStats
+
+LLM_CACHE_STATS = CacheStats()
+
+
+class LLMCache:
+    """Completions stored in a node-local SQLite file, shared by the worker processes on the node"""
+
+    def __init__(self, path: str = settings.llm_cache_path, ttl: float = settings.llm_cache_ttl,
+                 max_bytes: int = settings.llm_cache_max_bytes):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._ready = False
+
+    @staticmethod
+    def key(model: str, system_prompt: str, user_prompt: str, content_prompt: str) -> str:
+        payload = json.dumps([model, system_prompt, user_prompt, content_prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """One transaction on a fresh connection, closed afterwards"""
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                if not self._ready:
+                    self._create(connection)
+                yield connection
+        finally:
+            connection.close()
+
+    def _create(self, connection: sqlite3.Connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._ready = True
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT response FROM responses WHERE key = ? AND created > ?",
+                                     (key, now - self.ttl)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return None if row is None else row[0]
+
+    def _put(self, key: str, response: str):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                               (key, response, len(response.encode()), now, now))
+            connection.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+            total, = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if total <= self.max_bytes:
+                return
+            # Least recently used first, until the rest fits
+            for old_key, size in connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                total -= size
+                LLM_CACHE_STATS.evictions += 1
+
+    async def get(self, key: str) -> str | None:
+        if not settings.llm_cache_enabled:
+            return None
+        try:
+            response = await run_io(self._get, key)
+        except (sqlite3.Error, OSError):
+            # The cache is an optimisation, a broken file must not fail the summary
+            LLM_CACHE_STATS.errors += 1
+            response = None
+        if response is None:
+            LLM_CACHE_STATS.misses += 1
+        else:
+            LLM_CACHE_STATS.hits += 1
+        return response
+
+    async def put(self, key: str, response: str):
+        if not settings.llm_cache_enabled:
+            return
+        try:
+            await run_io(self._put, key, response)
+        except (sqlite3.Error, OSError):
+            LLM_CACHE_STATS.errors += 1
+            return
+        LLM_CACHE_STATS.stores += 1
+
+
+LLM_CACHE = LLMCache()
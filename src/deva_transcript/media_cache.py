@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import os
+import pathlib
+import shutil
+import time
+from collections.abc import Iterator
+
+from minio import Minio
+
+from config import settings
+from deva_transcript.executor import run_io
+from deva_transcript.s3 import download_file
+
+
+# Partial files of fills killed mid-download, older than this they are removed by eviction
+PARTIAL_MAX_AGE = 86400
+
+
+def _same_file(f, path: pathlib.Path) -> bool:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(f.fileno())
+    return (stat.st_dev, stat.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+@contextlib.contextmanager
+def _locked(path: pathlib.Path, blocking: bool = True) -> Iterator[bool]:
+    while True:
+        with path.open("a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                # Eviction unlinks lock files, a lock on an unlinked file excludes nobody: take the new one
+                if _same_file(f, path):
+                    yield True
+                    return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class MediaCache:
+    """Node-local copies of source objects, shared by all worker processes on the node"""
+
+    def __init__(self, root: str = settings.media_cache_dir, max_bytes: int = settings.media_cache_max_bytes,
+                 link: str = settings.media_cache_link):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.link = link
+        self._eviction: asyncio.Task | None = None
+
+    def entry(self, key: str) -> pathlib.Path:
+        return self.root / hashlib.sha256(key.encode()).hexdigest()
+
+    def _copy(self, source: pathlib.Path, destination: pathlib.Path):
+        if self.link == "hardlink":
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                pass  # other filesystem, fall back to a copy
+        shutil.copyfile(source, destination)
+
+    def _place(self, entry: pathlib.Path, destination: pathlib.Path):
+        # No symlinks: the task reopens its input many times, and eviction may unlink the entry meanwhile
+        destination.unlink(missing_ok=True)
+        self._copy(entry, destination)
+
+    def _get_or_fill(self, key: str, destination: pathlib.Path | None, fill) -> bool:
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = self.entry(key)
+        with _locked(entry.with_suffix(".lock")):
+            hit = entry.exists()
+            if not hit:
+                partial = entry.with_suffix(f".part{os.getpid()}")
+                try:
+                    fill(partial)
+                except BaseException:
+                    partial.unlink(missing_ok=True)
+                    raise
+                os.replace(partial, entry)
+            os.utime(entry)  # mtime is the LRU clock
+            if destination is not None:
+                self._place(entry, destination)
+        return hit
+
+    def _download(self, s3: Minio, minio_name: str, destination: pathlib.Path) -> bool:
+        if not settings.media_cache_enabled:
+            download_file(s3, minio_name, destination)
+            return False
+        stat = s3.stat_object(settings.minio_bucket, minio_name)
+
+        return self._get_or_fill(f"{minio_name}:{stat.etag}", destination,
+                                 lambda partial: download_file(s3, minio_name, partial))
+
+    def _derived_key(self, s3: Minio, minio_name: str, kind: str) -> str:
+        stat = s3.stat_object(settings.minio_bucket, minio_name)
+        return f"{minio_name}:{stat.etag}:{kind}"
+
+    def _get_derived(self, s3: Minio, minio_name: str, kind: str, destination: pathlib.Path) -> bool:
+        if not settings.media_cache_enabled:
+            return False
+        entry = self.entry(self._derived_key(s3, minio_name, kind))
+        self.root.mkdir(parents=True, exist_ok=True)
+        with _locked(entry.with_suffix(".lock")):
+            if not entry.exists():
+                return False
+            os.utime(entry)
+            self._place(entry, destination)
+        return True
+
+    def _put_derived(self, s3: Minio, minio_name: str, kind: str, source: pathlib.Path):
+        if not settings.media_cache_enabled:
+            return
+        self._get_or_fill(self._derived_key(s3, minio_name, kind), None,
+                          lambda partial: self._copy(source, partial))
+
+    async def fetch_derived(self, s3: Minio, minio_name: str, kind: str, destination: pathlib.Path) -> bool:
+        """Places an artifact derived from the object (e.g. converted audio) at destination if the node has it"""
+        return await run_io(self._get_derived, s3, minio_name, kind, destination)
+
+    async def store_derived(self, s3: Minio, minio_name: str, kind: str, source: pathlib.Path):
+        await run_io(self._put_derived, s3, minio_name, kind, source)
+        self.schedule_eviction()
+
+    async def fetch(self, s3: Minio, minio_name: str, destination: pathlib.Path) -> bool:
+        """Places the object at destination, downloading it only if the node has no copy; returns True on a hit"""
+        hit = await run_io(self._download, s3, minio_name, destination)
+        self.schedule_eviction()
+        return hit
+
+    def schedule_eviction(self):
+        if self._eviction is None or self._eviction.done():
+            self._eviction = asyncio.create_task(run_io(self.evict))
+
+    def evict(self):
+        if not self.root.exists():
+            return
+        with _locked(self.root / ".evict.lock", blocking=False) as acquired:
+            if not acquired:
+                return
+            entries = [(path, path.stat()) for path in self.root.iterdir() if not path.suffix]
+            total = sum(stat.st_size for _, stat in entries)
+            for path, stat in sorted(entries, key=lambda e: e[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                # Skip entries being filled or linked right now; hard links and copies handed out stay valid
+                lock = path.with_suffix(".lock")
+                with _locked(lock, blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    path.unlink(missing_ok=True)
+                    lock.unlink(missing_ok=True)
+                    total -= stat.st_size
+            self._remove_leftovers()
+
+    def _remove_leftovers(self):
+        # Locks of entries that were evicted or never filled (derived misses), partial files of killed fills
+        now = time.time()
+        for path in self.root.iterdir():
+            if path.suffix == ".lock" and path.name != ".evict.lock" and not path.with_suffix("").exists():
+                with _locked(path, blocking=False) as acquired:
+                    if acquired and not path.with_suffix("").exists():
+                        path.unlink(missing_ok=True)
+            elif path.suffix.startswith(".part"):
+                try:
+                    if now - path.stat().st_mtime > PARTIAL_MAX_AGE:
+                        path.unlink(missing_ok=True)
+                except FileNotFoundError:
+                    continue
+
+
+MEDIA_CACHE = MediaCache()
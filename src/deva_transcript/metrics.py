@@ -0,0 +1,190 @@
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import math
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+
+from config import settings
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, math.inf)
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{v}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = defaultdict(float)
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels: str):
+        self.values[tuple(labels[i] for i in self.labels)] += amount
+
+    def samples(self) -> Iterator[str]:
+        for values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, values)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self.values[tuple(labels[i] for i in self.labels)] = value
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.counts: dict[tuple[str, ...], list[int]] = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums: dict[tuple[str, ...], float] = defaultdict(float)
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels[i] for i in self.labels)
+        counts = self.counts[key]
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[n] += 1
+        self.sums[key] += value
+
+    def samples(self) -> Iterator[str]:
+        for values, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                yield f"{self.name}_bucket{_labels(self.labels, values, f'le="{le}"')} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {self.sums[values]}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {counts[-1]}"
+
+
+class StatsCollector:
+    """Exposes the fields of a stats dataclass (cache hits, progress updates, ...) as counters"""
+    type = "counter"
+
+    def __init__(self, name: str, help: str, stats):
+        self.name = name
+        self.help = help
+        self.stats = stats
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[str]:
+        for field in dataclasses.fields(self.stats):
+            yield f'{self.name}{{kind="{field.name}"}} {getattr(self.stats, field.name)}'
+
+
+REGISTRY: list[Counter | Histogram | StatsCollector] = []
+TASK_TYPE = str(settings.task_type.value)
+
+TASKS_IN_FLIGHT = Gauge("deva_tasks_in_flight", "Tasks being processed", ("task_type",))
+TASKS = Counter("deva_tasks_total", "Finished tasks", ("task_type", "status"))
+TASK_SECONDS = Histogram("deva_task_seconds", "Task wall time", ("task_type",))
+STAGE_SECONDS = Histogram("deva_stage_seconds", "Wall time of a task stage", ("task_type", "stage"))
+BYTES = Counter("deva_bytes_total", "Bytes moved to and from object storage", ("direction",))
+TRANSFER_RATE = Histogram("deva_transfer_mbytes_per_second", "Throughput of one object storage transfer", ("direction",),
+                          buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, math.inf))
+AUDIO_SECONDS = Counter("deva_audio_seconds_total", "Seconds of audio transcribed")
+REALTIME_FACTOR = Gauge("deva_transcribe_realtime_factor", "Audio seconds per wall second of the last transcription")
+SLIDES = Counter("deva_slides_total", "Unique slides extracted")
+SLIDES_PER_MINUTE = Gauge("deva_slides_per_minute", "Slides per wall minute of the last extraction")
+
+READY = False
+
+_timings: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar("timings", default=None)
+
+
+@contextlib.contextmanager
+def track_task() -> Iterator[dict[str, float]]:
+    """Collects the stages of the current task; the returned dict maps stage name to seconds"""
+    timings: dict[str, float] = {}
+    token = _timings.set(timings)
+    TASKS_IN_FLIGHT.inc(task_type=TASK_TYPE)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield timings
+        status = "ok"
+    finally:
+        TASKS_IN_FLIGHT.dec(task_type=TASK_TYPE)
+        TASKS.inc(task_type=TASK_TYPE, status=status)
+        TASK_SECONDS.observe(time.perf_counter() - start, task_type=TASK_TYPE)
+        _timings.reset(token)
+
+
+def record_stage(name: str, elapsed: float):
+    """For stages that cannot be a single with block, e.g. interleaved with another stage"""
+    STAGE_SECONDS.observe(elapsed, task_type=TASK_TYPE, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def mark_ready():
+    global READY
+    READY = True
+
+
+def format_timings(timings: dict[str, float]) -> str:
+    return ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # headers are not needed
+        path = request.split(b" ")[:2]
+        if path == [b"GET", b"/metrics"]:
+            status, body = "200 OK", render().encode()
+        elif path == [b"GET", b"/ready"]:
+            # Ready once the model is warmed up and the subscriber is consuming
+            status, body = ("200 OK", b"ready\n") if READY else ("503 Service Unavailable", b"starting\n")
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server() -> asyncio.Server | None:
+    if not settings.metrics_port:
+        return None
+    return await asyncio.start_server(_serve, settings.metrics_host, settings.metrics_port)
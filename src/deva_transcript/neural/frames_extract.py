@@ -1,8 +1,20 @@
-import os
+import math
 import pathlib
+import zlib
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import Executor, Future
+from typing import NamedTuple
 import numpy as np
 import cv2
-from skimage.metrics import mean_squared_error
+
+from config import settings
+from deva_transcript.neural.media import iter_key_frames
+
+# Меньшие отпечатки размывают строку текста: появление нового пункта списка не отличить от шума кодека
+FINGERPRINT_SIZE = (200, 150)
+# Строк отпечатков в одном сравнении, ограничивает временный массив разностей
+SCORE_BLOCK = 64
 
 def get_pixel_difference(img1, img2):
     """Возвращает процент различий между двумя изображениями (с учетом ресайза)"""
@@ -13,10 +25,18 @@ def get_pixel_difference(img1, img2):
     total_pixels = diff.shape[0] * diff.shape[1]
     return (non_zero_count / total_pixels) * 100
 
-def find_slide_region(frame):
-    """Находит область презентации в кадре"""
+def slide_mask(frame):
+    """Бинарная маска светлых областей кадра"""
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     _, thresh = cv2.threshold(gray, 50, 255, cv2.THRESH_BINARY)
+    return thresh
+
+def find_slide_region(frame):
+    """Находит область презентации в кадре"""
+    return find_mask_region(slide_mask(frame))
+
+def find_mask_region(thresh):
+    """Находит наибольшую светлую область на бинарной маске"""
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     max_area = 0
@@ -32,61 +52,303 @@ def find_slide_region(frame):
     return slide_region
 
 
-def get_video_stat(input: pathlib.Path):
-    cap = cv2.VideoCapture(str(input))
-    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-    frame_rate = cap.get(cv2.CAP_PROP_FPS)
-    cap.release()
-    return (int(total_frames), int(frame_rate))
+class SlideRegionTracker:
+    """Отслеживает область презентации между кадрами, полный поиск только при смене раскладки"""
 
-def extract_unique_slides(input_dir: pathlib.Path, output: pathlib.Path, total_frames: int, fps: int, threshold: float = 30):
-    
-    hashes = []
-    unique_count = 0
-    frame_count = 0
-    slide_region = None
+    def __init__(self, width: int = 640, change_ratio: float = 0.05, ring: int = 2):
+        self.width = width
+        self.change_ratio = change_ratio
+        self.ring = ring
+        self.region: tuple[int, int, int, int] | None = None
+        self.detections = 0
+        self._mask: np.ndarray | None = None
+        self._check: np.ndarray | None = None
 
-    for img_path in sorted(os.listdir(input_dir)):
-        frame = cv2.imread(str(input_dir / img_path))
+    def _layout_changed(self, mask: np.ndarray) -> bool:
+        if self._mask is None or self._check is None or mask.shape != self._mask.shape:
+            return True
+        changed = np.count_nonzero(mask[self._check] != self._mask[self._check])
+        return changed > self.change_ratio * max(int(np.count_nonzero(self._check)), 1)
 
-        frame_count = int(img_path.split("_")[1].split(".")[0])
-        new_slide_region = find_slide_region(frame)
-        if new_slide_region is None:
-            continue
+    def _remember(self, mask: np.ndarray, small_region: tuple[int, int, int, int]):
+        # Проверяем пиксели вне области и узкую рамку по ее краю: содержимое слайда в них не попадает
+        x, y, w, h = small_region
+        r = self.ring
+        check = np.ones(mask.shape, dtype=bool)
+        check[y + r:y + h - r, x + r:x + w - r] = False
+        self._mask = mask
+        self._check = check
 
-        if slide_region is None:
-            slide_region = new_slide_region
-        if slide_region != new_slide_region:
-            x1, y1, w1, h1 = slide_region
-            x2, y2, w2, h2 = new_slide_region
+    def mask(self, frame: np.ndarray) -> np.ndarray:
+        """Маска уменьшенного кадра, по которой работает update_mask"""
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.width / width)
+        small = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA) if scale < 1 else frame
+        return slide_mask(small)
+
+    def update(self, frame: np.ndarray) -> tuple[int, int, int, int] | None:
+        height, width = frame.shape[:2]
+        return self.update_mask(self.mask(frame), width, height)
+
+    def update_mask(self, mask: np.ndarray, width: int, height: int) -> tuple[int, int, int, int] | None:
+        """То же, что update, по готовой маске кадра размером width x height"""
+        scale = min(1.0, self.width / width)
+        if self.region is not None and not self._layout_changed(mask):
+            return self.region
+
+        self.detections += 1
+        small_region = find_mask_region(mask)
+        if small_region is None:
+            return None
+        x, y, w, h = small_region
+        new_region = (
+            int(x / scale), int(y / scale),
+            min(width, int(np.ceil(w / scale))), min(height, int(np.ceil(h / scale)))
+        )
+
+        if self.region is None:
+            self.region = new_region
+        elif self.region != new_region:
+            _, _, w1, h1 = self.region
+            _, _, w2, h2 = new_region
             area1 = w1 * h1
             area2 = w2 * h2
             if abs(area1 - area2) > (max(area1, area2) * 0.1):
-                slide_region = new_slide_region
-        
+                self.region = new_region
+        self._remember(mask, small_region)
+        return self.region
+
+
+class SlideIndex:
+    """Индекс уменьшенных отпечатков уникальных слайдов, сравнение со всей историей за одну операцию"""
+
+    def __init__(self, threshold: float, size: tuple[int, int] = FINGERPRINT_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self._fingerprints = np.empty((64, size[0] * size[1]), dtype=np.float32)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def fingerprint(self, slide: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(slide, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        return small.astype(np.float32).ravel()
+
+    def scores(self, fingerprint: np.ndarray, start: int = 0, end: int | None = None) -> np.ndarray:
+        diff = self._fingerprints[start:self._count if end is None else end] - fingerprint
+        return np.einsum("ij,ij->i", diff, diff) / fingerprint.size
+
+    def is_duplicate(self, fingerprint: np.ndarray) -> bool:
+        # С конца блоками: повтор обычно совпадает с одним из последних слайдов
+        for end in range(self._count, 0, -SCORE_BLOCK):
+            if self.scores(fingerprint, max(0, end - SCORE_BLOCK), end).min() < self.threshold:
+                return True
+        return False
+
+    def add(self, fingerprint: np.ndarray):
+        if self._count == len(self._fingerprints):
+            grown = np.empty((self._count * 2, self._fingerprints.shape[1]), dtype=np.float32)
+            grown[:self._count] = self._fingerprints
+            self._fingerprints = grown
+        self._fingerprints[self._count] = fingerprint
+        self._count += 1
+
+
+def warm_up_frames(width: int = 1280, height: int = 720):
+    """Прогон детектора и дедупликации на пустом кадре, чтобы первая задача не платила за инициализацию OpenCV"""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    SlideRegionTracker().update(frame)
+    SlideIndex(settings.frames_dedup_threshold).fingerprint(frame)
+
+
+def slides_params(threshold: float = settings.frames_dedup_threshold):
+    return {
+        "task": "frames_extract",
+        "threshold": threshold,
+        "fingerprint": FINGERPRINT_SIZE,
+    }
+
+
+def extract_unique_slides(frames: Iterable[tuple[float, np.ndarray]], output: pathlib.Path, duration: float, threshold: float = settings.frames_dedup_threshold):
+    """Отбирает уникальные слайды из потока ключевых кадров (время в секундах, кадр BGR)"""
+    index = SlideIndex(threshold)
+    tracker = SlideRegionTracker()
+    unique_count = 0
+
+    for timecode, frame in frames:
+        slide_region = tracker.update(frame)
+        if slide_region is None:
+            continue
+
         x, y, w, h = slide_region
 
         # Вырезаем область презентации
         slide = frame[y:y+h, x:x+w]
 
-        # Фильтрация уникальных кадров
-        slide_cv_gray = cv2.cvtColor(slide, cv2.COLOR_BGR2GRAY)
-
-        slide_cv_resize = cv2.resize(slide_cv_gray, (800, 600))
-        skip_flag = False
-        for last_slide_cv_gray in hashes[-5:]:
-            # pixel_diff = get_pixel_difference(slide_cv_gray, last_slide_cv_gray)
-            score = mean_squared_error(last_slide_cv_gray, slide_cv_resize)
-            if score < threshold:
-                skip_flag = True
-                break
-        
-        if skip_flag: 
+        # Фильтрация уникальных кадров по всем ранее сохраненным слайдам
+        fingerprint = index.fingerprint(slide)
+        if index.is_duplicate(fingerprint):
             continue
-        hashes.append(slide_cv_resize)
+        index.add(fingerprint)
         
         unique_count += 1
-        save_path = output / f"slide_{unique_count:03d}_s{int(frame_count/fps)}.png"
+        save_path = output / f"slide_{unique_count:03d}_s{int(timecode)}.png"
         cv2.imwrite(str(save_path), slide)
-        yield (frame_count / fps, total_frames / fps, save_path)
-    
\ No newline at end of file
+        yield (timecode, duration, save_path)
+
+
+class ChunkFrame(NamedTuple):
+    timecode: float
+    width: int
+    height: int
+    mask_shape: tuple[int, int]
+    mask: bytes  # упакованная маска, по ней слияние повторяет трекер всего видео
+    region: tuple[int, int, int, int] | None  # область по трекеру, начатому с начала отрезка
+    path: pathlib.Path | None
+    fingerprint: np.ndarray | None
+
+
+def _pack_mask(mask: np.ndarray) -> bytes:
+    return zlib.compress(np.packbits(mask > 0).tobytes(), 1)
+
+
+def _unpack_mask(frame: ChunkFrame) -> np.ndarray:
+    bits = np.unpackbits(np.frombuffer(zlib.decompress(frame.mask), np.uint8), count=math.prod(frame.mask_shape))
+    return bits.reshape(frame.mask_shape) * np.uint8(255)
+
+
+def _analyse_chunk(input_path: pathlib.Path, output: pathlib.Path, chunk: int, start: float, end: float | None, threshold: float):
+    """Анализирует отрезок видео в отдельном процессе: маска, область, отпечаток и локально уникальные слайды"""
+    index = SlideIndex(threshold)
+    tracker = SlideRegionTracker()
+    frames: list[ChunkFrame] = []
+
+    for timecode, frame in iter_key_frames(input_path, start, end):
+        height, width = frame.shape[:2]
+        mask = tracker.mask(frame)
+        slide_region = tracker.update_mask(mask, width, height)
+        path = None
+        fingerprint = None
+        if slide_region is not None:
+            x, y, w, h = slide_region
+            slide = frame[y:y+h, x:x+w]
+            fingerprint = index.fingerprint(slide)
+            if not index.is_duplicate(fingerprint):
+                index.add(fingerprint)
+                path = output / f"chunk_{chunk:04d}_{len(frames):05d}.png"
+                cv2.imwrite(str(path), slide)
+            fingerprint = fingerprint.astype(np.uint8)
+        frames.append(ChunkFrame(timecode, width, height, mask.shape, _pack_mask(mask), slide_region, path, fingerprint))
+
+    return frames
+
+
+def _read_slide(input_path: pathlib.Path, timecode: float, slide_region: tuple[int, int, int, int]):
+    x, y, w, h = slide_region
+    for _, frame in iter_key_frames(input_path, timecode):
+        return frame[y:y+h, x:x+w]
+    raise Exception(f"Frame at {timecode} not found")
+
+
+def _recrop_chunk(input_path: pathlib.Path, output: pathlib.Path, chunk: int,
+                  regions: dict[float, tuple[int, int, int, int]], threshold: float):
+    """Заново вырезает кадры отрезка по областям трекера всего видео за один проход декодера"""
+    index = SlideIndex(threshold)
+    last = max(regions)
+    result: dict[float, tuple[pathlib.Path | None, np.ndarray]] = {}
+    for timecode, frame in iter_key_frames(input_path, min(regions)):
+        if timecode > last:
+            break
+        if timecode not in regions:
+            continue
+        x, y, w, h = regions[timecode]
+        slide = frame[y:y+h, x:x+w]
+        fingerprint = index.fingerprint(slide)
+        path = None
+        if not index.is_duplicate(fingerprint):
+            index.add(fingerprint)
+            path = output / f"recrop_{chunk:04d}_{len(result):05d}.png"
+            cv2.imwrite(str(path), slide)
+        result[timecode] = (path, fingerprint.astype(np.uint8))
+    return result
+
+
+def extract_unique_slides_parallel(input_path: pathlib.Path, output: pathlib.Path, duration: float,
+                                   executor: Executor, workers: int,
+                                   chunk_seconds: float = settings.frames_chunk_seconds,
+                                   threshold: float = settings.frames_dedup_threshold):
+    """Параллельный вариант extract_unique_slides: отрезки видео анализируются в пуле процессов,
+    затем упорядоченное слияние повторяет трекер области по всему видео и убирает дубликаты на границах отрезков.
+    Результат совпадает с extract_unique_slides"""
+    chunks = max(workers, math.ceil(duration / chunk_seconds))
+    bounds = [duration * i / chunks for i in range(chunks)]
+
+    futures = [
+        executor.submit(_analyse_chunk, input_path, output, i, start,
+                        bounds[i + 1] if i + 1 < chunks else None, threshold)
+        for i, start in enumerate(bounds)
+    ]
+    recrops: list[Future] = []
+
+    def replay():
+        # Трекер отрезка начат с нуля и не знает гистерезиса предыдущих кадров: по маскам повторяем
+        # трекер всего видео, кадры с другой областью вырезаются заново в пуле
+        tracker = SlideRegionTracker()
+        for chunk, future in enumerate(futures):
+            frames = future.result()
+            regions = [tracker.update_mask(_unpack_mask(i), i.width, i.height) for i in frames]
+            stale = {i.timecode: region for i, region in zip(frames, regions)
+                     if region is not None and region != i.region}
+            recrop = None
+            if stale:
+                recrop = executor.submit(_recrop_chunk, input_path, output, chunk, stale, threshold)
+                recrops.append(recrop)
+            yield frames, regions, recrop
+
+    index = SlideIndex(threshold)
+    unique_count = 0
+
+    def merge(frames: list[ChunkFrame], regions: list[tuple[int, int, int, int] | None], recrop: Future | None):
+        nonlocal unique_count
+        recropped = recrop.result() if recrop is not None else {}
+        for frame, slide_region in zip(frames, regions):
+            path, fingerprint = frame.path, frame.fingerprint
+            if slide_region != frame.region:
+                if path is not None:
+                    path.unlink(missing_ok=True)
+                if slide_region is None:
+                    continue
+                path, fingerprint = recropped[frame.timecode]
+            elif slide_region is None:
+                continue
+            fingerprint = fingerprint.astype(np.float32)
+            if index.is_duplicate(fingerprint):
+                if path is not None:
+                    path.unlink(missing_ok=True)
+                continue
+            index.add(fingerprint)
+
+            unique_count += 1
+            save_path = output / f"slide_{unique_count:03d}_s{int(frame.timecode)}.png"
+            if path is not None:
+                path.rename(save_path)
+            else:
+                # Кадр был дубликатом внутри отрезка, но его пара отброшена глобально
+                cv2.imwrite(str(save_path), _read_slide(input_path, frame.timecode, slide_region))
+            yield (frame.timecode, duration, save_path)
+
+    try:
+        # Слияние отстает на workers отрезков, чтобы повторная нарезка шла параллельно
+        ahead: deque = deque()
+        for item in replay():
+            ahead.append(item)
+            if len(ahead) > workers:
+                yield from merge(*ahead.popleft())
+        while ahead:
+            yield from merge(*ahead.popleft())
+    finally:
+        for future in futures + recrops:
+            future.cancel()
@@ -0,0 +1,143 @@
+import pathlib
+import queue
+import threading
+import wave
+from collections.abc import Iterator
+from fractions import Fraction
+from typing import NamedTuple
+import av
+import ffmpeg
+import numpy as np
+from av.video.frame import VideoFrame
+from av.video.stream import VideoStream
+from ffmpeg_asyncio import FFmpeg
+
+# Media cache kind for the 16 kHz mono s16 WAV both extraction paths produce
+CONVERTED_AUDIO = "audio16k.wav"
+
+
+async def extract_audio_and_convert(input_path: pathlib.Path, output_path: pathlib.Path):
+    ffmpeg = (
+        FFmpeg()
+        .input(str(input_path))
+        .output(str(output_path), vn=None, ar="16k", sample_fmt="s16", ac="1", y=None)
+    )
+    await ffmpeg.execute()
+
+
+def stream_audio_pcm(url: str, start: float = 0.0, chunk_seconds: float = 30,
+                     max_buffered_seconds: float = 3600) -> Iterator[np.ndarray]:
+    """16 kHz mono float32 PCM decoded by ffmpeg straight from url, without temp files.
+
+    A reader thread keeps draining ffmpeg while the consumer runs inference,
+    so download and decode continue in the background.
+    """
+    stream = ffmpeg.input(url, ss=start) if start else ffmpeg.input(url)
+    process = (
+        stream
+        .output("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=16000, vn=None)
+        .global_args("-loglevel", "error", "-nostdin")
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    chunk_bytes = int(chunk_seconds * 16000) * 2
+    chunks: queue.Queue[bytes | None] = queue.Queue(maxsize=max(1, int(max_buffered_seconds / chunk_seconds)))
+
+    def read():
+        try:
+            while data := process.stdout.read(chunk_bytes):
+                chunks.put(data)
+        finally:
+            chunks.put(None)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while (data := chunks.get()) is not None:
+            yield np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+        if process.wait() != 0:
+            raise Exception(f"ffmpeg failed: {process.stderr.read().decode(errors='replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            # unblock the reader if it waits on a full queue
+            while reader.is_alive():
+                try:
+                    chunks.get_nowait()
+                except queue.Empty:
+                    reader.join(0.1)
+        process.wait()
+
+
+class MediaInfo(NamedTuple):
+    duration: float
+    fps: Fraction | None
+    has_video: bool
+    has_audio: bool
+    width: int
+    height: int
+
+
+def probe_media(input_path: pathlib.Path | str) -> MediaInfo:
+    with av.open(str(input_path)) as container:
+        video = container.streams.video[0] if container.streams.video else None
+        duration = 0.0
+        if container.duration is not None:
+            duration = container.duration / av.time_base
+        elif video is not None and video.duration is not None and video.time_base is not None:
+            duration = float(video.duration * video.time_base)
+        return MediaInfo(
+            duration=duration,
+            fps=Fraction(video.average_rate) if video is not None and video.average_rate else None,
+            has_video=video is not None,
+            has_audio=bool(container.streams.audio),
+            width=video.codec_context.width if video is not None else 0,
+            height=video.codec_context.height if video is not None else 0,
+        )
+
+
+def _key_frame_time(frame: VideoFrame, stream: VideoStream) -> float | None:
+    if frame.pts is None or stream.time_base is None:
+        return None
+    return float(frame.pts * stream.time_base)
+
+
+def extract_audio_and_key_frames(input_path: pathlib.Path, audio_path: pathlib.Path) -> Iterator[tuple[float, np.ndarray]]:
+    """Single demux pass: yields keyframes like iter_key_frames and writes 16 kHz mono s16 WAV to audio_path"""
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=16000)
+    with av.open(str(input_path)) as container, wave.open(str(audio_path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        video = container.streams.video[0]
+        video.codec_context.skip_frame = "NONKEY"
+        video.thread_type = "AUTO"
+        audio = container.streams.audio[0]
+        for packet in container.demux(video, audio):
+            for frame in packet.decode():
+                if packet.stream is audio:
+                    for resampled in resampler.resample(frame):
+                        wav.writeframes(resampled.to_ndarray().tobytes())
+                    continue
+                timecode = _key_frame_time(frame, video)
+                if timecode is not None:
+                    yield timecode, frame.to_ndarray(format="bgr24")
+        for resampled in resampler.resample(None):
+            wav.writeframes(resampled.to_ndarray().tobytes())
+
+
+def iter_key_frames(input_path: pathlib.Path, start: float | None = None, end: float | None = None) -> Iterator[tuple[float, np.ndarray]]:
+    with av.open(str(input_path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        stream.thread_type = "AUTO"
+        if start and stream.time_base is not None:
+            container.seek(int(start / stream.time_base), stream=stream)
+        for frame in container.decode(stream):
+            timecode = _key_frame_time(frame, stream)
+            if timecode is None:
+                continue
+            if start is not None and timecode < start:
+                continue
+            if end is not None and timecode >= end:
+                break
+            yield timecode, frame.to_ndarray(format="bgr24")
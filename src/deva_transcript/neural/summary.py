@@ -1,7 +1,14 @@
+import asyncio
 import json
 import pathlib
-from openai import OpenAI
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TextIO
+from openai import AsyncOpenAI
 from config import settings
+from deva_transcript.llm_cache import LLM_CACHE
+from deva_transcript.neural.utils import estimate_tokens
 
 OPENAI_API = None
 
@@ -22,25 +29,83 @@ SYSTEM_PROMPT = \
 Название изображения указывать только в круглых скобочках - это путь к файлу.
 """
 
+SECTION_PROMPT = SYSTEM_PROMPT + \
+"""
+Текст пользователя - это фрагмент длинной лекции, остальные фрагменты обрабатываются отдельно.
+Пиши конспект только этого фрагмента, без вступления и заключения ко всей лекции.
+"""
+
+REDUCE_PROMPT = \
+"""
+Ты ассистент, который объединяет конспекты фрагментов одной лекции в один конспект.
+Конспекты фрагментов идут по порядку. Сохрани порядок изложения, убери повторы, не добавляй своих мыслей.
+Пиши конспект в формате markdown.
+
+В первом сообщении будут пожелания пользователя к конспекту.
+Во втором сообщении будут конспекты фрагментов.
+
+Ссылки на изображения вида ![](Название изображения) переноси без изменений.
+"""
+
+# Expected summary length relative to the prompt, only used to scale progress
+SUMMARY_RATIO = 0.2
+
+
 def load_openai_model():
     global OPENAI_API
     if OPENAI_API is not None:
         return
-    OPENAI_API = OpenAI(
+    OPENAI_API = AsyncOpenAI(
         base_url=settings.openai_base_url,
         api_key=settings.openai_api_key
     )
 
-def create_summary(user_prompt: str, content_prompt: str, output_path: pathlib.Path):
+
+async def warm_up_openai():
+    """Opens the connection to the API before the first task; a backend without /models is not an error"""
+    if OPENAI_API is None:
+        raise Exception("Model is not loaded")
+    try:
+        await OPENAI_API.models.list()
+    except Exception:
+        pass
+
+
+@dataclass
+class CompletionStats:
+    calls: int = 0
+    cached: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    received: int = 0  # streamed chunks so far, roughly one token each
+    first_token: float | None = None  # seconds from the first request to its first token
+
+
+ProgressCallback = Callable[[float], None]
+
+
+async def complete(system_prompt: str, user_prompt: str, content_prompt: str, output: TextIO | None = None,
+                   stats: CompletionStats | None = None, on_chunk: Callable[[], None] | None = None) -> str | None:
     if OPENAI_API is None:
         raise Exception("Model is not loaded")
+    stats = stats or CompletionStats()
+    stats.calls += 1
+
+    key = LLM_CACHE.key(settings.openai_api_model_name, system_prompt, user_prompt, content_prompt)
+    cached = await LLM_CACHE.get(key)
+    if cached is not None:
+        stats.cached += 1
+        if output is not None:
+            output.write(cached)
+        return cached
 
-    response = OPENAI_API.chat.completions.create(
+    start = time.perf_counter()
+    stream = await OPENAI_API.chat.completions.create(
         model=settings.openai_api_model_name,
         messages=[
             {
                 "role": "system",
-                "content": SYSTEM_PROMPT
+                "content": system_prompt
             },
             {
                 "role": "user",
@@ -50,7 +115,94 @@ def create_summary(user_prompt: str, content_prompt: str, output_path: pathlib.P
                 "role": "user",
                 "content": content_prompt
             }
-        ]
+        ],
+        stream=True,
+        stream_options={"include_usage": True}
     )
 
-    return response.choices[0].message.content
\ No newline at end of file
+    parts: list[str] = []
+    async for chunk in stream:
+        if chunk.usage is not None:
+            stats.prompt_tokens += chunk.usage.prompt_tokens
+            stats.completion_tokens += chunk.usage.completion_tokens
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if not parts and stats.first_token is None:
+            stats.first_token = time.perf_counter() - start
+        parts.append(chunk.choices[0].delta.content)
+        stats.received += 1
+        if output is not None:
+            output.write(parts[-1])
+            output.flush()
+        if on_chunk is not None:
+            on_chunk()
+
+    if not parts:
+        return None
+    content = "".join(parts)
+    await LLM_CACHE.put(key, content)
+    return content
+
+
+async def create_summary(user_prompt: str, sections: list[str], output_path: pathlib.Path,
+                         stats: CompletionStats | None = None, on_progress: ProgressCallback | None = None,
+                         previous: list[str | None] | None = None) -> tuple[str | None, list[str] | None]:
+    """Streams the summary into output_path; progress is reported from received tokens.
+
+    Sections with a summary in previous are not sent to the model again. Returns the summary
+    and the per-section summaries; with a reduce pass the latter are the map output it merged.
+    """
+    stats = stats or CompletionStats()
+    previous = previous or [None] * len(sections)
+    reduce = len(sections) > 1 and settings.summary_reduce
+    pending = [text for text, summary in zip(sections, previous) if summary is None]
+    expected = sum(estimate_tokens(i) for i in pending) * SUMMARY_RATIO * (2 if reduce else 1)
+
+    def on_chunk():
+        if on_progress is not None:
+            on_progress(min(stats.received / max(expected, 1), 0.99))
+
+    with output_path.open("w", encoding="utf-8") as output:
+        if len(sections) == 1:
+            summary = previous[0]
+            if summary is None:
+                summary = await complete(SYSTEM_PROMPT, user_prompt, sections[0], output, stats, on_chunk)
+            else:
+                output.write(summary)
+            return summary, None if summary is None else [summary]
+
+        # Map: sections are summarized concurrently; image names are global, so references stay valid
+        semaphore = asyncio.Semaphore(settings.summary_concurrency)
+        done: dict[int, str | None] = {}
+        written = 0
+        separator = ""
+
+        def write_ready():
+            # Without a reduce pass finished sections are the output, written in order as soon as the earlier ones are
+            nonlocal written, separator
+            while done.get(written) is not None:
+                text = done[written].strip()
+                if text:
+                    output.write(separator + text)
+                    separator = "\n\n"
+                written += 1
+            output.flush()
+
+        async def summarize_section(n: int, text: str, summary: str | None):
+            if summary is None:
+                async with semaphore:
+                    summary = await complete(SECTION_PROMPT, user_prompt, text, None, stats, on_chunk)
+            done[n] = summary
+            if not reduce:
+                write_ready()
+
+        await asyncio.gather(*(summarize_section(n, *i) for n, i in enumerate(zip(sections, previous))))
+        summaries = [done[n] for n in range(len(sections))]
+        if any(i is None for i in summaries):
+            return None, None
+        summaries = [i.strip() for i in summaries]
+        merged = "\n\n".join(i for i in summaries if i)
+        if not reduce:
+            return merged, summaries
+        summary = await complete(REDUCE_PROMPT, user_prompt, merged, output, stats, on_chunk)
+        return summary, None if summary is None else summaries
@@ -1,41 +1,238 @@
-import json
+import os
 import pathlib
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from typing import NamedTuple
+
+import numpy as np
 from config import settings
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.utils import download_model
+
+from deva_transcript.neural.transcript_io import TranscriptWriter
+from deva_transcript.neural.utils import TranscriptEntry
+
+SAMPLING_RATE = 16000
+LANGUAGE = "ru"
+
+
+class DecodingProfile(NamedTuple):
+    name: str
+    model: str
+    compute_type: str
+    beam_size: int
+
+
+def compute_type():
+    return "float16" if settings.whisper_device == "cuda" else "int8"
+
+
+def profiles() -> dict[str, DecodingProfile]:
+    return {
+        # Greedy decoding with a small model: previews that should be back in a fraction of real time
+        "draft": DecodingProfile("draft", settings.whisper_draft_model_name, "int8", 1),
+        "standard": DecodingProfile("standard", settings.whisper_model_name, compute_type(), 5),
+        # The original settings, used when a task does not ask for anything else
+        "accurate": DecodingProfile("accurate", settings.whisper_model_name, compute_type(), 10),
+    }
+
+
+def resolve_profile(name: str | None) -> DecodingProfile:
+    available = profiles()
+    name = name or settings.whisper_profile
+    if name not in available:
+        raise Exception(f"Unknown decoding profile: {name}")
+    return available[name]
+
+
+class LoadedModel(NamedTuple):
+    model: WhisperModel
+    pipeline: BatchedInferencePipeline | None
+    size: int
+
+
+def _model_path(name: str) -> str:
+    if os.path.isdir(name):
+        return name
+    try:
+        return download_model(name, local_files_only=True)
+    except Exception:
+        return download_model(name)
+
+
+def _model_bytes(path: str, compute_type: str) -> int:
+    """Estimated memory of a loaded model from the size of its converted weights"""
+    size = sum(i.stat().st_size for i in pathlib.Path(path).iterdir() if i.is_file())
+    # faster-whisper ships float16 weights; int8 quantization halves them
+    return size // 2 if compute_type.startswith("int8") else size
+
+
+class ModelPool:
+    """Loaded models keyed by name and compute type, least recently used evicted above max_bytes"""
+
+    def __init__(self, max_bytes: int = settings.whisper_pool_max_bytes):
+        self.max_bytes = max_bytes
+        self._models: OrderedDict[tuple[str, str], LoadedModel] = OrderedDict()
+        self._lock = threading.Lock()
 
-WHISPER_MODEL = None
+    def get(self, profile: DecodingProfile) -> LoadedModel:
+        key = (profile.model, profile.compute_type)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            path = _model_path(profile.model)
+            size = _model_bytes(path, profile.compute_type)
+            # Evict before loading so the peak stays under the limit; the newest model always fits
+            while self._models and sum(i.size for i in self._models.values()) + size > self.max_bytes:
+                # A task still decoding with an evicted model keeps its reference until it finishes
+                self._models.popitem(last=False)
+            model = WhisperModel(
+                path,
+                device=settings.whisper_device,
+                compute_type=profile.compute_type,
+                cpu_threads=settings.whisper_cpu_threads,
+                num_workers=settings.worker_cpu_threads
+            )
+            pipeline = BatchedInferencePipeline(model) if settings.whisper_batch_size > 0 else None
+            self._models[key] = LoadedModel(model, pipeline, size)
+            return self._models[key]
+
+
+MODEL_POOL: ModelPool | None = None
+
+
+def transcribe_params(profile: DecodingProfile):
+    return {
+        "task": "transcribe",
+        "model": profile.model,
+        "compute_type": profile.compute_type,
+        "beam_size": profile.beam_size,
+        "language": LANGUAGE,
+        "batch_size": settings.whisper_batch_size,
+        "format": settings.transcript_format,
+    }
 
 
 def load_whisper_model():
-    global WHISPER_MODEL
-    if WHISPER_MODEL is not None:
+    """Creates the pool and loads the default profile, so the common case never waits for a load"""
+    global MODEL_POOL
+    if MODEL_POOL is not None:
         return
-    WHISPER_MODEL = WhisperModel(
-        settings.whisper_model_name,
-        device=settings.whisper_device,
-        compute_type="float16" if settings.whisper_device == "cuda" else "int8",
-        cpu_threads=settings.whisper_cpu_threads
-    )
+    MODEL_POOL = ModelPool()
+    MODEL_POOL.get(resolve_profile(None))
 
 
-def transcribe_audio(input_path: pathlib.Path, output_path: pathlib.Path):
-    if WHISPER_MODEL is None:
+def get_model(profile: DecodingProfile) -> LoadedModel:
+    if MODEL_POOL is None:
         raise Exception("Model is not loaded")
-    segments, info = WHISPER_MODEL.transcribe(
-        str(input_path),
-        beam_size=10,
+    return MODEL_POOL.get(profile)
+
+
+def warm_up_whisper(seconds: float = 2):
+    """One short decode, so the first task does not pay for kernel and allocator initialisation"""
+    profile = resolve_profile(None)
+    audio = np.random.default_rng(0).normal(0, 0.01, int(seconds * SAMPLING_RATE)).astype(np.float32)
+    # Without VAD, otherwise the noise is filtered out and the model never runs
+    segments, _ = get_model(profile).model.transcribe(
+        audio, beam_size=profile.beam_size, language=LANGUAGE, vad_filter=False)
+    list(segments)
+
+
+def _decode(audio: np.ndarray, profile: DecodingProfile):
+    loaded = get_model(profile)
+    options = dict(
+        beam_size=profile.beam_size,
         condition_on_previous_text=False,
         vad_filter=True,
-        language="ru"
+        language=LANGUAGE
     )
-    result = []
+    if loaded.pipeline is not None:
+        # VAD-split chunks decoded in batches; segments come back in order with global timestamps
+        return loaded.pipeline.transcribe(
+            audio,
+            batch_size=settings.whisper_batch_size,
+            without_timestamps=False,
+            **options
+        )
+    return loaded.model.transcribe(audio, **options)
+
+
+def transcribe_audio(input_path: pathlib.Path, writer: TranscriptWriter, profile: DecodingProfile,
+                     done: list[TranscriptEntry] | None = None):
+    done = done or []
+    offset = done[-1]["end"] if done else 0.0
+    for entry in done:
+        writer.write(entry)
+    audio = decode_audio(str(input_path), sampling_rate=SAMPLING_RATE)
+    audio = audio[int(offset * SAMPLING_RATE):]
+
+    segments, info = _decode(audio, profile)
     for segment in segments:
-        result.append({
-            "start": segment.start,
-            "end": segment.end,
+        entry: TranscriptEntry = {
+            "start": offset + segment.start,
+            "end": offset + segment.end,
             "text": segment.text
-        })
-        yield (segment.end, info.duration)
+        }
+        writer.write(entry)
+        yield (entry["end"], offset + info.duration, entry)
+
+    writer.close()
+
+
+def transcribe_stream(chunks: Iterator[np.ndarray], duration: float, writer: TranscriptWriter,
+                      profile: DecodingProfile, done: list[TranscriptEntry] | None = None,
+                      window: float = settings.whisper_stream_window, margin: float = 30):
+    """Transcribes PCM as it arrives, one window at a time, so inference starts before the download ends.
+
+    chunks must start at the end of the last done segment. Segments reaching into the last `margin`
+    seconds of a window may be cut, so they are decoded again at the start of the next window.
+    """
+    done = done or []
+    offset = done[-1]["end"] if done else 0.0
+    for entry in done:
+        writer.write(entry)
+
+    window_samples = int(window * SAMPLING_RATE)
+    pending: list[np.ndarray] = []
+    buffered = 0
+    finished = False
+    while not finished:
+        for chunk in chunks:
+            pending.append(chunk)
+            buffered += len(chunk)
+            if buffered >= window_samples:
+                break
+        else:
+            finished = True
+        if not buffered:
+            break
+
+        audio = np.concatenate(pending)
+        length = len(audio) / SAMPLING_RATE
+        segments, _ = _decode(audio, profile)
+        cut = length
+        last_end = 0.0
+        for segment in segments:
+            if not finished and segment.end > length - margin and segment.start > 0:
+                cut = segment.start
+                break
+            entry: TranscriptEntry = {
+                "start": offset + segment.start,
+                "end": offset + segment.end,
+                "text": segment.text
+            }
+            writer.write(entry)
+            last_end = segment.end
+            yield (entry["end"], max(duration, entry["end"]), entry)
+        else:
+            if not finished:
+                cut = max(length - margin, last_end)
+
+        rest = audio[int(cut * SAMPLING_RATE):]
+        pending = [rest] if len(rest) else []
+        buffered = len(rest)
+        offset += cut
 
-    with output_path.open("w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
+    writer.close()
@@ -0,0 +1,127 @@
+import json
+import pathlib
+from array import array
+from collections.abc import Iterator
+from typing import Literal
+
+from deva_transcript.neural.utils import TranscriptEntry
+
+TranscriptFormat = Literal["json", "jsonl", "columnar"]
+
+EXTENSIONS: dict[str, str] = {
+    "json": ".json",
+    "jsonl": ".jsonl",
+    "columnar": ".json",
+}
+
+
+class JsonTranscriptWriter:
+    """Pretty JSON list, the original format; segments are kept until close"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._segments: list[TranscriptEntry] = []
+
+    def write(self, segment: TranscriptEntry):
+        self._segments.append(segment)
+
+    def close(self):
+        with self.path.open("w", encoding="utf-8") as f:
+            json.dump(self._segments, f, ensure_ascii=False, indent=4)
+
+
+class JsonlTranscriptWriter:
+    """One segment per line, written as soon as it is decoded"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._file = path.open("w", encoding="utf-8")
+
+    def write(self, segment: TranscriptEntry):
+        self._file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnarTranscriptWriter:
+    """{"start": [...], "end": [...], "text": [...]} without per-segment keys"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._start = array("d")
+        self._end = array("d")
+        self._text: list[str] = []
+
+    def write(self, segment: TranscriptEntry):
+        self._start.append(segment["start"])
+        self._end.append(segment["end"])
+        self._text.append(segment["text"])
+
+    def close(self):
+        with self.path.open("w", encoding="utf-8") as f:
+            json.dump({"start": self._start.tolist(), "end": self._end.tolist(), "text": self._text},
+                      f, ensure_ascii=False, separators=(",", ":"))
+
+
+TranscriptWriter = JsonTranscriptWriter | JsonlTranscriptWriter | ColumnarTranscriptWriter
+
+
+def open_transcript_writer(path: pathlib.Path, format: TranscriptFormat) -> TranscriptWriter:
+    if format == "jsonl":
+        return JsonlTranscriptWriter(path)
+    if format == "columnar":
+        return ColumnarTranscriptWriter(path)
+    return JsonTranscriptWriter(path)
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 16) -> Iterator[TranscriptEntry]:
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()[1:]  # skip "["
+    while True:
+        buffer = buffer.lstrip().lstrip(",").lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            segment, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield segment
+        buffer = buffer[end:]
+
+
+def read_transcript(path: pathlib.Path) -> Iterator[TranscriptEntry]:
+    """Streams segments from any of the transcript formats"""
+    with path.open(encoding="utf-8") as f:
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        if head == "[":
+            f.seek(0)
+            yield from _iter_json_array(f)
+            return
+
+        f.seek(0)
+        first = f.readline()
+        while first and not first.strip():
+            first = f.readline()
+        if not first:
+            return
+        if first.rstrip().endswith("}"):
+            data = json.loads(first)
+            if not isinstance(data.get("start"), list):
+                yield data
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+                return
+        else:
+            # Columnar file spread over several lines
+            f.seek(0)
+            data = json.load(f)
+        for start, end, text in zip(data["start"], data["end"], data["text"]):
+            yield {"start": start, "end": end, "text": text}
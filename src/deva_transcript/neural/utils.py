@@ -1,28 +1,12 @@
-import pathlib
-from typing import NotRequired, TypedDict
+import bisect
+import hashlib
+import heapq
+from collections.abc import Iterable
+from operator import itemgetter
+from typing import NamedTuple, NotRequired, TypedDict
 from uuid import UUID
-from ffmpeg_asyncio import FFmpeg
 from deva_p1_db.models import Note, File
 
-
-async def extract_audio_and_convert(input_path: pathlib.Path, output_path: pathlib.Path):
-    ffmpeg = (
-        FFmpeg()
-        .input(str(input_path))
-        .output(str(output_path), vn=None, ar="16k", sample_fmt="s16", ac="1", y=None)
-    )
-    await ffmpeg.execute()
-
-
-async def extract_key_frames(input_path: pathlib.Path, output_path: pathlib.Path, fps=1):
-
-    ffmpeg = (
-        FFmpeg()
-        .input(str(input_path), skip_frame="nokey")
-        .output(str(output_path / 'keyframe_%05d.jpg'), vsync='0', frame_pts='true', y=None)
-    )
-    await ffmpeg.execute()
-
 TranscriptEntry = TypedDict(
     'TranscriptEntry', {'start': float, 'end': float, 'text': str})
 
@@ -32,59 +16,136 @@ class PromptEntry(TypedDict):
     text: str
     timestamp: float
     name: NotRequired[str]
+    id: NotRequired[UUID]
+
+
+class PromptBuild(NamedTuple):
+    prompt: str
+    image_mapping: dict[str, UUID]
+    entries: list[PromptEntry]
+    offsets: list[int]  # where each entry starts in prompt, plus len(prompt) at the end
+    tokens: list[int]  # estimated tokens of each entry
+
+
+class PromptSection(NamedTuple):
+    start: float
+    end: float
+    text: str
+    digest: str  # hash of the section with image ids instead of names, which shift when images are hidden
+
+
+# Rough ratio for Russian text, good enough to size chunks without a tokenizer
+CHARS_PER_TOKEN = 3
+
 
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
 
-def generate_prompt(transcript: list[TranscriptEntry], notes: list[Note], images: list[File]):
-    prompt_list: list[PromptEntry] = []
+
+def build_prompt(transcript: Iterable[TranscriptEntry], notes: list[Note], images: list[File]) -> PromptBuild:
+    """Merges the time-ordered transcript with notes and images in one pass.
+
+    The transcript is consumed lazily and must be ordered by start, as whisper writes it.
+    """
+    note_entries: list[PromptEntry] = sorted((
+        {'type': 'note', 'text': i.text.strip(), 'timestamp': i.start_time_code}
+        for i in notes
+    ), key=itemgetter('timestamp'))
+
+    image_entries: list[PromptEntry] = []
     image_mapping: dict[str, UUID] = {}
-    img_count = 1
-
-    for i in transcript:
-        prompt_list.append(
-            {
-                'type': 'text',
-                'text': i['text'].strip("\n").strip(),
-                'timestamp': i['start']
-            }
-        )
-    for i in notes:
-        prompt_list.append(
-            {
-                'type': 'note',
-                'text': i.text.strip("\n").strip(),
-                'timestamp': i.start_time_code
-            }
-        )
     for i in images:
         if i.metadata_timecode is None:
             continue
         if i.metadata_text is None:
             continue
-        image_name = f"{img_count:04}.png"
-        prompt_list.append(
-            {
-                'type': 'image',
-                'text': i.metadata_text.strip("\n").strip(),
-                'name': image_name,
-                'timestamp': i.metadata_timecode
-            }
-        )
+        image_name = f"{len(image_mapping) + 1:04}.png"
+        image_entries.append({'type': 'image', 'text': i.metadata_text.strip(), 'name': image_name,
+                              'id': i.id, 'timestamp': i.metadata_timecode})
         image_mapping[image_name] = i.id
-        img_count += 1
-
-    prompt_list.sort(key=lambda x: x['timestamp'])
-    prompt = ""
-    for i in prompt_list:
-        if i['type'] == 'note':
-            prompt += f"\n<заметка>{i['text']}</заметка>\n"
-        elif i['type'] == 'image':
-            if 'name' not in i:
-                continue
-            prompt += f"\n<изображение>{i['name']} : {i['text']}</изображение>\n"
-        elif i['type'] == 'text':
-            if prompt and prompt[-1] != "\n":
-                prompt += " "
-            prompt += i['text']
-            if prompt[-1] in ['.', '!', '?']:
-                prompt += '\n'
-    return prompt, image_mapping
+    image_entries.sort(key=itemgetter('timestamp'))
+
+    # Notes and images are few: merge them once, then interleave with the transcript as it streams.
+    # Ties keep the order of the original sort: text, then notes, then images
+    extras = list(heapq.merge(note_entries, image_entries, key=itemgetter('timestamp')))
+    entries: list[PromptEntry] = []
+    parts: list[str] = []
+    offsets: list[int] = []
+    tokens: list[int] = []
+    size = 0
+    last = ""
+    n = 0
+
+    def add(entry: PromptEntry, part: str):
+        nonlocal size, last
+        entries.append(entry)
+        parts.append(part)
+        offsets.append(size)
+        tokens.append(len(part) // CHARS_PER_TOKEN)
+        size += len(part)
+        last = part[-1:] or last
+
+    def add_extras(until: float):
+        nonlocal n
+        while n < len(extras) and extras[n]['timestamp'] < until:
+            i = extras[n]
+            if i['type'] == 'note':
+                add(i, f"\n<заметка>{i['text']}</заметка>\n")
+            else:
+                add(i, f"\n<изображение>{i['name']} : {i['text']}</изображение>\n")
+            n += 1
+
+    for segment in transcript:
+        start = segment['start']
+        if n < len(extras) and extras[n]['timestamp'] < start:
+            add_extras(start)
+        text = segment['text'].strip()
+        part = text if not size or last == "\n" else " " + text
+        if part:
+            last = part[-1]
+            if last in '.!?':
+                part += "\n"
+                last = "\n"
+        # Inlined add(): this loop runs once per whisper segment
+        entries.append({'type': 'text', 'text': text, 'timestamp': start})
+        parts.append(part)
+        offsets.append(size)
+        tokens.append(len(part) // CHARS_PER_TOKEN)
+        size += len(part)
+    add_extras(float("inf"))
+    offsets.append(size)
+    return PromptBuild("".join(parts), image_mapping, entries, offsets, tokens)
+
+
+def generate_prompt(transcript: Iterable[TranscriptEntry], notes: list[Note], images: list[File]):
+    build = build_prompt(transcript, notes, images)
+    return build.prompt, build.image_mapping
+
+
+def _section(build: PromptBuild, first: int, last: int, start: float) -> PromptSection:
+    digest = hashlib.sha256()
+    for i in build.entries[first:last]:
+        digest.update(f"{i['type']}\0{i.get('id', '')}\0{i['text']}\n".encode())
+    end = build.entries[last - 1]['timestamp'] if last > first else start
+    return PromptSection(start, end, build.prompt[build.offsets[first]:build.offsets[last]], digest.hexdigest())
+
+
+def generate_sections(transcript: Iterable[TranscriptEntry], notes: list[Note], images: list[File],
+                      max_tokens: int = 0, bounds: list[float] | None = None):
+    """Splits the prompt into time ranges, either by token budget or at the given section starts"""
+    build = build_prompt(transcript, notes, images)
+    if bounds:
+        starts = list(bounds)
+        timestamps = [i['timestamp'] for i in build.entries]
+        cuts = [0] + [bisect.bisect_left(timestamps, i) for i in bounds[1:]]
+    else:
+        starts, cuts = [0.0], [0]
+        size = 0
+        for n, tokens in enumerate(build.tokens):
+            if max_tokens > 0 and n > cuts[-1] and size + tokens > max_tokens:
+                starts.append(build.entries[n]['timestamp'])
+                cuts.append(n)
+                size = 0
+            size += tokens
+    cuts.append(len(build.entries))
+    return [_section(build, cuts[n], cuts[n + 1], start) for n, start in enumerate(starts)], build.image_mapping
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+from faststream.rabbit import RabbitBroker
+
+from deva_p1_db.enums.rabbit import RabbitQueuesToBack
+from deva_p1_db.schemas.task import TaskStatusToBack
+
+from config import settings
+
+
+@dataclass
+class ProgressStats:
+    sent: int = 0
+    dropped: int = 0
+    failed: int = 0
+
+
+PROGRESS_STATS = ProgressStats()
+
+
+class ProgressReporter:
+    """Coalesces progress updates and publishes them in the background, at most one in flight"""
+
+    def __init__(self, broker: RabbitBroker, task_id: UUID,
+                 min_interval: float = settings.progress_min_interval,
+                 min_delta: float = settings.progress_min_delta):
+        self.broker = broker
+        self.task_id = task_id
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._progress = 0.0
+        self._sent_at = 0.0
+        self._publishing: asyncio.Task | None = None
+        self.sent = 0
+        self.dropped = 0
+
+    def update(self, progress: float):
+        """Never waits for the broker, so it is safe to call from the compute loop for every item"""
+        now = time.monotonic()
+        if progress - self._progress < self.min_delta or now - self._sent_at < self.min_interval \
+                or (self._publishing is not None and not self._publishing.done()):
+            self.dropped += 1
+            PROGRESS_STATS.dropped += 1
+            return
+        self._progress, self._sent_at = progress, now
+        self._publishing = asyncio.create_task(self._publish(progress))
+
+    async def _publish(self, progress: float):
+        try:
+            await self.broker.publish(TaskStatusToBack(task_id=self.task_id, progress=progress),
+                                      RabbitQueuesToBack.progress_task)
+        except Exception:
+            # Progress is advisory, a lost update must not fail the task
+            PROGRESS_STATS.failed += 1
+            return
+        self.sent += 1
+        PROGRESS_STATS.sent += 1
+
+    async def close(self):
+        if self._publishing is not None:
+            await self._publishing
+
+    async def finish(self):
+        await self.close()
+        await self._publish(1.0)
@@ -0,0 +1,56 @@
+import io
+import json
+from typing import TypedDict
+
+from minio import Minio
+from minio.error import S3Error
+
+from config import settings
+from deva_transcript.executor import run_io
+
+
+class SectionProvenance(TypedDict):
+    start: float
+    end: float
+    digest: str
+    summary: str
+
+
+class SummaryProvenance(TypedDict):
+    model: str
+    prompt: str
+    sections: list[SectionProvenance]
+
+
+def provenance_name(minio_name: str) -> str:
+    return f"provenance/{minio_name}.json"
+
+
+def _read(s3: Minio, object_name: str) -> bytes:
+    response = s3.get_object(settings.minio_bucket, object_name)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+async def load_provenance(s3: Minio, minio_name: str) -> SummaryProvenance | None:
+    """Which time ranges fed which section of a summary, with the section summaries themselves"""
+    try:
+        data = await run_io(_read, s3, provenance_name(minio_name))
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            raise
+        return None
+    return json.loads(data)
+
+
+async def delete_provenance(s3: Minio, minio_name: str):
+    await run_io(s3.remove_object, settings.minio_bucket, provenance_name(minio_name))
+
+
+async def save_provenance(s3: Minio, minio_name: str, provenance: SummaryProvenance):
+    data = json.dumps(provenance, ensure_ascii=False).encode()
+    await run_io(s3.put_object, settings.minio_bucket, provenance_name(minio_name), io.BytesIO(data), len(data),
+                 content_type="application/json")
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, TypedDict
+
+from minio import Minio
+from minio.commonconfig import CopySource
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+from config import settings
+from deva_transcript.executor import run_io
+
+
+class CachedFile(TypedDict):
+    name: str
+    timecode: float | None
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    errors: int = 0
+
+
+RESULT_CACHE_STATS = CacheStats()
+
+_eviction: asyncio.Task | None = None
+
+
+class ResultCache:
+    """Results stored under cache/<key>/ in the bucket, keyed by source ETag, size and processing params"""
+
+    def __init__(self, s3: Minio, prefix: str = settings.result_cache_prefix, logger: logging.Logger | None = None):
+        self.s3 = s3
+        self.prefix = prefix
+        self.logger = logger
+
+    def _failed(self, action: str, e: Exception):
+        # The cache is an optimisation: a failure is counted and logged, never raised into the task
+        RESULT_CACHE_STATS.errors += 1
+        if self.logger is not None:
+            self.logger.warning(f"Result cache {action} failed: {e}")
+
+    async def key(self, source_minio_name: str, params: dict[str, Any]) -> str:
+        stat = await run_io(self.s3.stat_object, settings.minio_bucket, source_minio_name)
+        payload = json.dumps({"etag": stat.etag, "size": stat.size, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _manifest_name(self, key: str) -> str:
+        return f"{self.prefix}{key}/manifest.json"
+
+    def object_name(self, key: str, name: str) -> str:
+        return f"{self.prefix}{key}/{name}"
+
+    def _read(self, object_name: str) -> bytes:
+        response = self.s3.get_object(settings.minio_bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def _write_manifest(self, key: str, data: bytes):
+        self.s3.put_object(settings.minio_bucket, self._manifest_name(key), io.BytesIO(data), len(data),
+                           content_type="application/json")
+
+    async def get(self, key: str) -> list[CachedFile] | None:
+        if not settings.result_cache_enabled:
+            return None
+        try:
+            data = await run_io(self._read, self._manifest_name(key))
+            files = json.loads(data)["files"]
+        except Exception as e:
+            if not isinstance(e, S3Error) or e.code != "NoSuchKey":
+                self._failed("read", e)
+            RESULT_CACHE_STATS.misses += 1
+            return None
+        RESULT_CACHE_STATS.hits += 1
+        try:
+            # Rewriting the manifest bumps its mtime, which eviction uses as last access
+            await run_io(self._write_manifest, key, data)
+        except Exception as e:
+            self._failed("access update", e)
+        return files
+
+    async def put(self, key: str, files: list[tuple[CachedFile, str]]):
+        """Copies already uploaded objects into the cache; the manifest is written last"""
+        if not settings.result_cache_enabled:
+            return
+        try:
+            await asyncio.gather(*(
+                run_io(self.s3.copy_object, settings.minio_bucket, self.object_name(key, file["name"]),
+                       CopySource(settings.minio_bucket, source))
+                for file, source in files
+            ))
+            data = json.dumps({"files": [file for file, _ in files]}, ensure_ascii=False).encode()
+            await run_io(self._write_manifest, key, data)
+        except Exception as e:
+            # Without the manifest the copied objects are never read and go first on eviction
+            self._failed("store", e)
+            return
+        RESULT_CACHE_STATS.stores += 1
+        self.schedule_eviction()
+
+    async def copy(self, key: str, name: str, destination: str):
+        await run_io(self.s3.copy_object, settings.minio_bucket, destination,
+                     CopySource(settings.minio_bucket, self.object_name(key, name)))
+
+    def schedule_eviction(self):
+        global _eviction
+        if _eviction is None or _eviction.done():
+            _eviction = asyncio.create_task(self._evict())
+
+    async def _evict(self):
+        try:
+            await run_io(self.evict)
+        except Exception as e:
+            self._failed("eviction", e)
+
+    def evict(self):
+        sizes: dict[str, int] = defaultdict(int)
+        accessed: dict[str, datetime] = {}
+        written: dict[str, datetime] = {}
+        for obj in self.s3.list_objects(settings.minio_bucket, prefix=self.prefix, recursive=True):
+            if obj.object_name is None or obj.last_modified is None:
+                continue
+            key = obj.object_name[len(self.prefix):].split("/", 1)[0]
+            sizes[key] += obj.size or 0
+            written[key] = max(written.get(key, obj.last_modified), obj.last_modified)
+            if obj.object_name.endswith("/manifest.json"):
+                accessed[key] = obj.last_modified
+
+        total = sum(sizes.values())
+        # Entries without a manifest are ordered by their latest write, so stale partial puts go early
+        for key in sorted(sizes, key=lambda k: accessed.get(k, written[k])):
+            if total <= settings.result_cache_max_bytes:
+                break
+            names = self.s3.list_objects(settings.minio_bucket, prefix=f"{self.prefix}{key}/", recursive=True)
+            for error in self.s3.remove_objects(settings.minio_bucket,
+                                                (DeleteObject(obj.object_name) for obj in names if obj.object_name)):
+                raise Exception(f"Cache eviction failed: {error}")
+            total -= sizes[key]
+            RESULT_CACHE_STATS.evictions += 1
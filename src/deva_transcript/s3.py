@@ -1,16 +1,105 @@
-
+import os
+import pathlib
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Annotated
+
+import certifi
+import urllib3
 from faststream import Depends
 from minio import Minio
 
 from config import settings
+from deva_transcript.metrics import BYTES, TRANSFER_RATE
 
-async def get_s3_client() -> Minio:
+S3_CLIENT: Minio | None = None
+
+# Range requests of one download; separate from IO_EXECUTOR, whose threads wait on these
+TRANSFER_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.s3_transfer_concurrency, thread_name_prefix="s3")
+
+
+def create_s3_client() -> Minio:
+    # One pool for the whole process: connections are reused across messages and transfer threads
+    http_client = urllib3.PoolManager(
+        maxsize=settings.s3_max_connections,
+        block=True,
+        timeout=urllib3.Timeout(connect=10, read=300),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where()
+    )
     return Minio(
         endpoint=settings.minio_ip + ":" + str(settings.minio_port),
         access_key=settings.minio_access_key,
         secret_key=settings.minio_secret_key,
-        secure=settings.minio_secure
+        secure=settings.minio_secure,
+        http_client=http_client
     )
 
-S3_client = Annotated[Minio, Depends(get_s3_client)]
\ No newline at end of file
+
+async def get_s3_client() -> Minio:
+    global S3_CLIENT
+    if S3_CLIENT is None:
+        S3_CLIENT = create_s3_client()
+    return S3_CLIENT
+
+
+def _record(direction: str, size: int, start: float):
+    BYTES.inc(size, direction=direction)
+    TRANSFER_RATE.observe(size / 1024 ** 2 / max(time.perf_counter() - start, 1e-9), direction=direction)
+
+
+def _download_range(s3: Minio, minio_name: str, fd: int, offset: int, length: int):
+    response = s3.get_object(settings.minio_bucket, minio_name, offset=offset, length=length)
+    try:
+        position = offset
+        for chunk in response.stream(1024 ** 2):
+            position += os.pwrite(fd, chunk, position)
+    finally:
+        response.close()
+        response.release_conn()
+    if position != offset + length:
+        raise Exception(f"Short read of {minio_name} at {offset}: {position - offset} of {length} bytes")
+
+
+def download_file(s3: Minio, minio_name: str, destination: pathlib.Path | str):
+    """Large objects are fetched as parallel ranged GETs written in place, small ones in one request"""
+    start = time.perf_counter()
+    size = s3.stat_object(settings.minio_bucket, minio_name).size or 0
+    part_size = settings.s3_part_size
+    if size <= part_size or settings.s3_transfer_concurrency <= 1:
+        s3.fget_object(settings.minio_bucket, minio_name, str(destination))
+        _record("download", size, start)
+        return
+
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    parts: list[Future] = []
+    try:
+        os.ftruncate(fd, size)
+        parts = [TRANSFER_EXECUTOR.submit(_download_range, s3, minio_name, fd, offset, min(part_size, size - offset))
+                 for offset in range(0, size, part_size)]
+        for part in parts:
+            part.result()
+    except BaseException:
+        for part in parts:
+            part.cancel()
+        # Running parts still write to fd, it must stay open until they are done
+        wait(parts)
+        os.close(fd)
+        pathlib.Path(destination).unlink(missing_ok=True)
+        raise
+    os.close(fd)
+    _record("download", size, start)
+
+
+def upload_file(s3: Minio, minio_name: str, source: pathlib.Path | str, content_type: str,
+                metadata: dict[str, str] | None = None):
+    """Multipart upload with parts sent concurrently once the file is above the part size"""
+    start = time.perf_counter()
+    s3.fput_object(settings.minio_bucket, minio_name, str(source), content_type=content_type, metadata=metadata,
+                   part_size=settings.s3_part_size, num_parallel_uploads=settings.s3_transfer_concurrency)
+    _record("upload", os.path.getsize(source), start)
+
+
+S3_client = Annotated[Minio, Depends(get_s3_client)]
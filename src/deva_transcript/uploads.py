@@ -0,0 +1,44 @@
+import asyncio
+import pathlib
+
+from minio import Minio
+from minio.commonconfig import CopySource
+
+from config import settings
+from deva_transcript.executor import run_io
+from deva_transcript.s3 import upload_file
+
+
+class BulkUploader:
+    def __init__(self, s3: Minio, concurrency: int = settings.upload_concurrency):
+        self._s3 = s3
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: list[asyncio.Task] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            return
+        await self.wait()
+
+    def submit(self, minio_name: str, source: pathlib.Path | str, content_type: str):
+        """Uploads a local file, or copies an object already in the bucket when source is an object name"""
+        self._tasks.append(asyncio.create_task(
+            self._upload(minio_name, source, content_type)))
+
+    async def _upload(self, minio_name: str, source: pathlib.Path | str, content_type: str):
+        async with self._semaphore:
+            if isinstance(source, str):
+                await run_io(self._s3.copy_object, settings.minio_bucket,
+                             minio_name, CopySource(settings.minio_bucket, source))
+                return
+            await run_io(upload_file, self._s3, minio_name, source, content_type)
+
+    async def wait(self):
+        tasks, self._tasks = self._tasks, []
+        await asyncio.gather(*tasks)